@@ -0,0 +1,88 @@
+"""Compare the JSON codecs the plugin can use on ENSIME payloads.
+
+    python bench/codec.py [recording.jsonl] [iterations]
+
+A recording holds one websocket message per line. Without one, a large
+NewScalaNotesEvent and UsesOfSymbolAtPoint reply are generated instead.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'rplugin', 'python',
+                    'pensive'))
+
+import codec  # noqa: E402
+
+
+def notes_event(count):
+    return {
+        'payload': {
+            'typehint': 'NewScalaNotesEvent',
+            'isFull': False,
+            'notes': [{
+                'file': '/src/main/scala/pkg/File%d.scala' % (i % 300),
+                'msg': 'value foo%d is not a member of Bar' % i,
+                'severity': {'typehint': 'NoteError'},
+                'beg': i * 10,
+                'end': i * 10 + 5,
+                'line': i % 2000,
+                'col': i % 80
+            } for i in range(count)]
+        }
+    }
+
+
+def usages_reply(count):
+    return {
+        'callId': 42,
+        'payload': {
+            'typehint': 'ERangePositions',
+            'positions': [{
+                'file': '/src/main/scala/pkg/File%d.scala' % (i % 300),
+                'offset': i * 17,
+                'start': i * 17,
+                'end': i * 17 + 3
+            } for i in range(count)]
+        }
+    }
+
+
+def messages(path):
+    if path:
+        with open(path, 'r') as fh:
+            return [line.rstrip('\n') for line in fh if line.strip()]
+    return [
+        codec.dumps(notes_event(20000)),
+        codec.dumps(usages_reply(2000))
+    ]
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    raw = messages(path)
+    size = sum(len(m) for m in raw)
+    print('%d messages, %.1f KB' % (len(raw), size / 1024.0))
+
+    for name, loads, dumps in codec.available():
+        start = time.time()
+        for _ in range(iterations):
+            decoded = [loads(m) for m in raw]
+        decode = (time.time() - start) / iterations
+
+        start = time.time()
+        for _ in range(iterations):
+            for obj in decoded:
+                dumps(obj)
+        encode = (time.time() - start) / iterations
+
+        print('%-10s decode %7.2f ms  encode %7.2f ms  %6.1f MB/s%s' % (
+            name, decode * 1000, encode * 1000,
+            size / decode / 1024 / 1024,
+            '  (selected)' if name == codec.name else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Compare decoding TypeInfo/SymbolInfo payloads eagerly and lazily.
+
+    python bench/decode.py [iterations]
+
+The eager classes below are the previous implementation; the lazy ones are
+what the plugin uses now. Each iteration decodes a SymbolInfo for a deeply
+generic type and reads what `run` reads.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'rplugin', 'python',
+                    'pensive'))
+
+import ensime  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class EagerTypeInfo(object):
+    @classmethod
+    def fromJson(cls, payload):
+        if payload is None:
+            return None
+        if payload.get('typehint') == 'ArrowTypeInfo':
+            return EagerArrowTypeInfo(payload)
+        return EagerBasicTypeInfo(payload)
+
+
+class EagerBasicTypeInfo(EagerTypeInfo):
+    def __init__(self, payload):
+        self.name = payload['name']
+        self.decl_as = None
+        self.full_name = payload['fullName']
+        self.type_args = [
+            EagerTypeInfo.fromJson(t) for t in payload['typeArgs']
+        ]
+        self.members = None
+        self.pos = ensime.SourcePosition.fromJson(payload.get('pos'))
+        self.outer_type_id = None
+
+
+class EagerArrowTypeInfo(EagerTypeInfo):
+    def __init__(self, payload):
+        self.name = payload['name']
+        self.full_name = payload['resultType']['fullName']
+        self.result_type = EagerTypeInfo.fromJson(payload['resultType'])
+        self.param_sections = None
+        self.decl_as = None
+        self.type_args = None
+        self.members = None
+        self.pos = None
+        self.outer_type_id = None
+
+
+class EagerSymbolInfo(object):
+    def __init__(self, payload):
+        self.name = payload.get('name')
+        self.local_name = payload.get('localName')
+        self.decl_pos = ensime.SourcePosition.fromJson(payload.get('declPos'))
+        self.type = EagerTypeInfo.fromJson(payload.get('type'))
+        self.is_callable = payload.get('isCallable')
+        self.owner_type_id = payload.get('ownerTypeId')
+
+
+def generic_type(depth, width):
+    # e.g. Kleisli[Future, Map[String, List[Either[...]]], ...]
+    payload = {
+        'typehint': 'BasicTypeInfo',
+        'name': 'T%d' % depth,
+        'fullName': 'scala.collection.T%d' % depth,
+        'declAs': {'typehint': 'Class'},
+        'typeArgs': [],
+        'members': [],
+        'pos': {
+            'typehint': 'OffsetSourcePosition',
+            'file': '/src/T%d.scala' % depth,
+            'offset': depth
+        }
+    }
+    if depth:
+        payload['typeArgs'] = [
+            generic_type(depth - 1, width) for _ in range(width)
+        ]
+    return payload
+
+
+def symbol(depth, width):
+    return {
+        'typehint': 'SymbolInfo',
+        'name': 'run',
+        'localName': 'run',
+        'declPos': {
+            'typehint': 'OffsetSourcePosition',
+            'file': '/src/Main.scala',
+            'offset': 120
+        },
+        'type': {
+            'typehint': 'ArrowTypeInfo',
+            'name': '(Int)T',
+            'resultType': generic_type(depth, width),
+            'paramSections': []
+        },
+        'isCallable': True
+    }
+
+
+def touch(info):
+    # what SymbolInfo.run reads
+    getattr(info.decl_pos, 'file', None)
+    getattr(info.type, 'file', None)
+    return info.type and info.type.pos
+
+
+def measure(name, decode, payload, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        touch(decode(payload))
+    elapsed = time.time() - start
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        kept = [decode(payload) for _ in range(100)]
+        for info in kept:
+            touch(info)
+        peak = tracemalloc.get_traced_memory()[1] / 100
+        tracemalloc.stop()
+
+    print('%-6s %8.1f us/decode  %s' % (
+        name, elapsed / iterations * 1e6,
+        '%8d bytes/decode' % peak if peak is not None else ''))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    payload = symbol(depth=4, width=3)
+    measure('eager', EagerSymbolInfo, payload, iterations)
+    measure('lazy', ensime.SymbolInfo, payload, iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""Run the plugin in a headless Neovim against the fake ENSIME server.
+
+    python bench/driver.py [hover|typecheck|uses ...]
+    python bench/driver.py --recording session.jsonl [--speed 1]
+
+Each scenario generates a session, replays it through bench/fake_server.py
+and reports per stage latency and throughput: `recv` (decode and queue on
+the receiving thread), `update` (one main loop drain), `dispatch` and
+`reply` (send to handled) per typehint, and `run` per response class.
+A recording made with g:pensive_record is replayed by re-sending its
+requests at their recorded times.
+
+Needs nvim on the PATH and the neovim and websocket-client packages.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from functools import wraps
+from threading import Event, Lock, Thread
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'rplugin', 'python'))
+sys.path.insert(0, os.path.join(HERE, '..', 'rplugin', 'python', 'pensive'))
+
+import neovim  # noqa: E402
+import ensime  # noqa: E402
+from fake_server import ReplayServer  # noqa: E402
+from recorder import read_recording  # noqa: E402
+from pensive import EnsimeClient  # noqa: E402
+
+# seconds to wait for a scenario's messages to be handled
+SCENARIO_TIMEOUT = 300
+
+
+def entry(t, direction, message):
+    return {'t': t, 'dir': direction, 'msg': json.dumps(message)}
+
+
+def hover_session(project_dir, count=500):
+    session = []
+    for i in range(1, count + 1):
+        session.append(entry(i * 0.001, 'send', {
+            'callId': i,
+            'req': {'typehint': 'TypeAtPointReq'}
+        }))
+        session.append(entry(i * 0.001, 'recv', {
+            'callId': i,
+            'payload': {
+                'typehint': 'BasicTypeInfo',
+                'name': 'Future',
+                'fullName': 'scala.concurrent.Future',
+                'typeArgs': [{
+                    'typehint': 'BasicTypeInfo',
+                    'name': 'Int',
+                    'fullName': 'scala.Int',
+                    'typeArgs': []
+                }]
+            }
+        }))
+    return session
+
+
+def typecheck_session(project_dir, events=400, notes=50):
+    session = [
+        entry(0, 'send', {
+            'callId': 1, 'req': {'typehint': 'TypecheckFilesReq'}
+        }),
+        entry(0, 'recv', {
+            'callId': 1, 'payload': {'typehint': 'VoidResponse'}
+        })
+    ]
+    for i in range(events):
+        session.append(entry(i * 0.002, 'recv', {'payload': {
+            'typehint': 'NewScalaNotesEvent',
+            'isFull': False,
+            'notes': [{
+                'file': os.path.join(project_dir, 'src', 'F%d.scala' % i),
+                'msg': 'type mismatch %d' % n,
+                'severity': {'typehint': 'NoteWarning'},
+                'beg': n * 10,
+                'end': n * 10 + 3,
+                'line': n + 1,
+                'col': 1
+            } for n in range(notes)]
+        }}))
+    session.append(entry(events * 0.002, 'recv', {
+        'payload': {'typehint': 'FullTypeCheckCompleteEvent'}
+    }))
+    return session
+
+
+def uses_session(project_dir, hits=5000, files=300):
+    src = os.path.join(project_dir, 'src')
+    line = 'val x = foo(bar) + foo(baz)\n'
+    for i in range(files):
+        with open(os.path.join(src, 'U%d.scala' % i), 'w') as fh:
+            fh.write(line * 2000)
+    positions = [{
+        'file': os.path.join(src, 'U%d.scala' % (i % files)),
+        'offset': (i // files) * len(line) + 8,
+        'start': (i // files) * len(line) + 8,
+        'end': (i // files) * len(line) + 11
+    } for i in range(hits)]
+    return [
+        entry(0, 'send', {
+            'callId': 1, 'req': {'typehint': 'UsesOfSymbolAtPointReq'}
+        }),
+        entry(0.01, 'recv', {
+            'callId': 1,
+            'payload': {'typehint': 'ERangePositions', 'positions': positions}
+        })
+    ]
+
+
+class Recorded(object):
+    # re-sends a recorded request and decodes the reply like the command
+    # that originally sent it
+    commands = dict(
+        (cls.typehint, cls) for cls in vars(ensime).values()
+        if isinstance(cls, type) and hasattr(cls, 'request') and
+        hasattr(cls, 'typehint')
+    )
+
+    def __init__(self, req):
+        self._request = req
+
+    def response(self, payload):
+        command = self.commands.get(self._request['typehint'])
+        if command is None:
+            return ensime.VoidResponse(payload)
+        return command().response(payload)
+
+
+class Timings(object):
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = Lock()
+        self.handled = 0
+        self.expected = None
+        self.done = Event()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    def timed(self, stage, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.time() - start)
+        return wrapper
+
+    def count(self):
+        with self.lock:
+            self.handled += 1
+            if self.expected is not None and self.handled >= self.expected:
+                self.done.set()
+
+    def report(self, name, wall):
+        print('\n%s: %.3fs wall, %d messages handled, %.0f msg/s' % (
+            name, wall, self.handled, self.handled / wall if wall else 0))
+        print('%-40s %7s %9s %9s %9s %9s' % (
+            'stage', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'max ms'))
+        for stage in sorted(self.samples):
+            values = sorted(self.samples[stage])
+            n = len(values)
+            print('%-40s %7d %9.3f %9.3f %9.3f %9.3f' % (
+                stage, n, sum(values) / n * 1000, values[n // 2] * 1000,
+                values[min(n - 1, int(n * 0.95))] * 1000, values[-1] * 1000))
+
+
+def instrument(client, timings):
+    sent = {}
+    client.recv = timings.timed('recv', client.recv)
+    client.update = timings.timed('update', client.update)
+
+    send = client.send
+
+    def timed_send(command, *args, **kwargs):
+        request = send(command, *args, **kwargs)
+        sent[request.call_id] = (time.time(), command._request['typehint'])
+        return request
+    client.send = timed_send
+
+    dispatch = client.dispatch
+
+    def timed_dispatch(result):
+        typehint = result.get('payload', {}).get('typehint')
+        start = time.time()
+        try:
+            dispatch(result)
+        finally:
+            end = time.time()
+            timings.add('dispatch %s' % typehint, end - start)
+            if result.get('callId') in sent:
+                began, request = sent.pop(result['callId'])
+                timings.add('reply %s' % request, end - began)
+            timings.count()
+    client.dispatch = timed_dispatch
+
+
+def instrument_responses(current):
+    # patched once, samples go to the running scenario's Timings
+    def timed(name, run):
+        @wraps(run)
+        def wrapper(*args, **kwargs):
+            return current[0].timed('run %s' % name, run)(*args, **kwargs)
+        return wrapper
+    for cls in list(vars(ensime).values()):
+        if isinstance(cls, type) and 'run' in vars(cls):
+            cls.run = timed(cls.__name__, vars(cls)['run'])
+
+
+def replay_requests(client, call, session, speed):
+    started = time.time()
+    for item in session:
+        if item['dir'] != 'send':
+            continue
+        if speed:
+            delay = started + item['t'] / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        req = json.loads(item['msg'])['req']
+        call(client.send, Recorded(req))
+
+
+def hover_requests(client, call, session, speed):
+    # goes through the real command, position capture included
+    count = sum(1 for item in session if item['dir'] == 'send')
+    for i in range(count):
+        call(client.vim.command, 'normal! %dG%d|' % (i % 50 + 1, i % 20 + 1))
+        call(client.responses.clear)
+        call(client.command_type_at_point)
+
+
+SCENARIOS = {
+    'hover': (hover_session, hover_requests),
+    'typecheck': (typecheck_session, replay_requests),
+    'uses': (uses_session, replay_requests),
+}
+
+
+def run(name, session, issue, project_dir, speed, current):
+    ReplayServer(session, project_dir, speed).start()
+    vim = neovim.attach('child', argv=[
+        'nvim', '--embed', '--headless', '-u', 'NONE', '-i', 'NONE'])
+    client = EnsimeClient(vim)
+    client.project_dir = project_dir
+    timings = current[0] = Timings()
+    instrument(client, timings)
+
+    def call(fn, *args):
+        done = Event()
+        result = []
+
+        def invoke():
+            try:
+                result.append(fn(*args))
+            finally:
+                done.set()
+        vim.session.threadsafe_call(invoke)
+        done.wait()
+        return result[0] if result else None
+
+    def scenario():
+        try:
+            scratch = os.path.join(project_dir, 'src', 'Bench.scala')
+            with open(scratch, 'w') as fh:
+                fh.write('object Bench { val x: Int = 1 }\n' * 50)
+            call(vim.command, 'edit %s' % scratch)
+            call(client.connect)
+            while not call(lambda: client.project(scratch).is_running):
+                time.sleep(0.05)
+            timings.expected = sum(
+                1 for item in session if item['dir'] == 'recv')
+            started = time.time()
+            issue(client, call, session, speed)
+            timings.done.wait(SCENARIO_TIMEOUT)
+            timings.report(name, time.time() - started)
+        finally:
+            vim.session.threadsafe_call(vim.stop_loop)
+
+    thread = Thread(target=scenario)
+    thread.daemon = True
+    thread.start()
+    vim.run_loop(None, None)
+    client.projects.close()
+    vim.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pensive benchmarks')
+    parser.add_argument('scenarios', nargs='*', default=sorted(SCENARIOS))
+    parser.add_argument('--recording', help='replay a g:pensive_record file')
+    parser.add_argument(
+        '--speed', type=float, default=0,
+        help='replay speed, 1 is the recorded pace and 0 as fast as possible')
+    args = parser.parse_args()
+
+    current = [None]
+    instrument_responses(current)
+    project_dir = tempfile.mkdtemp(prefix='pensive-bench')
+    os.makedirs(os.path.join(project_dir, 'src'))
+    try:
+        if args.recording:
+            run(args.recording, read_recording(args.recording),
+                replay_requests, project_dir, args.speed, current)
+            return
+        for name in args.scenarios:
+            make_session, issue = SCENARIOS[name]
+            run(name, make_session(project_dir), issue, project_dir,
+                args.speed, current)
+    finally:
+        shutil.rmtree(project_dir)
+
+
+if __name__ == '__main__':
+    main()
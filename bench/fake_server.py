@@ -0,0 +1,213 @@
+"""A fake ENSIME websocket server replaying a recorded session.
+
+    python bench/fake_server.py recording.jsonl project_dir [speed]
+
+Frames ENSIME sent are replayed in order. Replies wait for the editor to
+send a request of the same typehint as the recorded one they answer and are
+rewritten to its callId, requests nothing was recorded for go unanswered;
+notifications keep their recorded spacing divided by `speed`, where 0
+means as fast as possible. The port is written to
+project_dir/.ensime_cache/http so the plugin connects as usual.
+"""
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from collections import defaultdict, deque
+from threading import Thread
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'rplugin', 'python',
+                    'pensive'))
+
+from recorder import read_recording  # noqa: E402
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# seconds to wait for the editor to send a recorded request
+REQUEST_TIMEOUT = 30
+
+
+class WebsocketConnection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def _read(self, count):
+        while len(self.buffer) < count:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise EOFError()
+            self.buffer.extend(chunk)
+        data, self.buffer = self.buffer[:count], self.buffer[count:]
+        return data
+
+    def handshake(self):
+        while b'\r\n\r\n' not in self.buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise EOFError()
+            self.buffer.extend(chunk)
+        head, rest = bytes(self.buffer).split(b'\r\n\r\n', 1)
+        self.buffer = bytearray(rest)
+        headers = dict(
+            (k.strip().lower(), v.strip()) for k, v in (
+                line.split(':', 1)
+                for line in head.decode('latin-1').split('\r\n')[1:]
+                if ':' in line)
+        )
+        accept = base64.b64encode(hashlib.sha1(
+            (headers['sec-websocket-key'] + GUID).encode('ascii')
+        ).digest()).decode('ascii')
+        response = [
+            'HTTP/1.1 101 Switching Protocols',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Accept: %s' % accept
+        ]
+        if 'sec-websocket-protocol' in headers:
+            response.append('Sec-WebSocket-Protocol: jerky')
+        self.sock.sendall(
+            ('\r\n'.join(response) + '\r\n\r\n').encode('ascii'))
+
+    def recv(self):
+        # returns the next text frame, None once the editor closed
+        while True:
+            b1, b2 = self._read(2)
+            opcode, masked, length = b1 & 0x0f, b2 & 0x80, b2 & 0x7f
+            if length == 126:
+                length = struct.unpack('>H', bytes(self._read(2)))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', bytes(self._read(8)))[0]
+            mask = self._read(4) if masked else None
+            data = self._read(length)
+            if mask:
+                data = bytearray(b ^ mask[i % 4] for i, b in enumerate(data))
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self._send(0xa, bytes(data))
+            elif opcode in (0x1, 0x2):
+                return bytes(data).decode('utf-8')
+
+    def send(self, text):
+        self._send(0x1, text.encode('utf-8'))
+
+    def _send(self, opcode, data):
+        length = len(data)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        self.sock.sendall(header + data)
+
+
+def typehint(message):
+    return message.get('req', {}).get('typehint')
+
+
+class ReplayServer(object):
+    def __init__(self, entries, project_dir, speed=1.0):
+        self.entries = entries
+        self.speed = speed
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.port = self.listener.getsockname()[1]
+
+        cache_dir = os.path.join(project_dir, '.ensime_cache')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(os.path.join(cache_dir, 'http'), 'w') as fh:
+            fh.write('%d\n' % self.port)
+
+    def serve_forever(self):
+        while True:
+            sock, _ = self.listener.accept()
+            thread = Thread(target=self.replay, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def start(self):
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def replay(self, sock):
+        conn = WebsocketConnection(sock)
+        conn.handshake()
+        requests = queue.Queue()
+
+        def read():
+            try:
+                while True:
+                    message = conn.recv()
+                    if message is None:
+                        break
+                    parsed = json.loads(message)
+                    requests.put((typehint(parsed), parsed['callId']))
+            except (EOFError, socket.error):
+                pass
+            requests.put(None)
+        reader = Thread(target=read)
+        reader.daemon = True
+        reader.start()
+
+        call_ids = {}
+        # requests received ahead of the recorded one of their typehint
+        received = defaultdict(deque)
+        started = time.time()
+        try:
+            for entry in self.entries:
+                message = json.loads(entry['msg'])
+                if entry['dir'] == 'send':
+                    wanted = typehint(message)
+                    while not received[wanted]:
+                        request = requests.get(timeout=REQUEST_TIMEOUT)
+                        if request is None:
+                            return
+                        received[request[0]].append(request[1])
+                    call_ids[message['callId']] = received[wanted].popleft()
+                    continue
+                if self.speed:
+                    delay = started + entry['t'] / self.speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                if message.get('callId') is not None:
+                    message['callId'] = call_ids.get(
+                        message['callId'], message['callId'])
+                    conn.send(json.dumps(message))
+                else:
+                    conn.send(entry['msg'])
+            # keep the connection open until the editor is done with it
+            reader.join()
+        except (queue.Empty, socket.error):
+            pass
+        finally:
+            sock.close()
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+    speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    server = ReplayServer(read_recording(sys.argv[1]), sys.argv[2], speed)
+    print('replaying on port %d' % server.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
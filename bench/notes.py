@@ -0,0 +1,165 @@
+"""Compare the scala notes store before and after the tuple based entries.
+
+    python bench/notes.py [entries]
+
+The classes below are the previous implementation: one object per entry
+summing its field hashes, a set per file and a full sort of every entry
+whenever the list is shown. Both stores receive the same NewScalaNotesEvent
+sized batches, are listed, have one file's notes replaced and are listed
+again.
+"""
+import os
+import sys
+import time
+from operator import attrgetter
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'rplugin', 'python',
+                    'pensive'))
+
+from utils import QuickfixEntry, ScalaNotes, severities  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# notes per NewScalaNotesEvent
+BATCH = 200
+FILES = 500
+
+
+class OldQuickfixEntry(object):
+    def __init__(self):
+        self.filename = None
+        self.line_number = None
+        self.column = None
+        self.text = None
+        self.severity = None
+
+    def __eq__(self, other):
+        return (
+            self.filename == other.filename and
+            self.line_number == other.line_number and
+            self.column == other.column and
+            self.text == other.text and
+            self.severity == other.severity
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return (
+            self.filename.__hash__() +
+            self.line_number.__hash__() +
+            self.column.__hash__() +
+            self.text.__hash__() +
+            self.severity.__hash__()
+        )
+
+    def to_dict(self):
+        return {
+            'filename': self.filename,
+            'lnum': self.line_number,
+            'col': self.column,
+            'text': self.text,
+            'type': self.severity
+        }
+
+    @classmethod
+    def fromScalaNote(cls, payload):
+        entry = cls()
+        entry.filename = payload['file']
+        entry.line_number = payload['line']
+        entry.column = payload['col']
+        entry.text = payload['msg']
+        entry.severity = severities.get(payload['severity']['typehint'], '')
+        return entry
+
+
+class OldScalaNotes(object):
+    order = staticmethod(attrgetter('filename', 'line_number', 'severity'))
+
+    def __init__(self):
+        self.files = {}
+
+    def add(self, entries):
+        added = []
+        for entry in entries:
+            notes = self.files.setdefault(entry.filename, set())
+            if entry not in notes:
+                notes.add(entry)
+                added.append(entry)
+        return sorted(added, key=self.order)
+
+    def remove(self, filename):
+        return bool(self.files.pop(filename, None))
+
+    def entries(self):
+        return sorted(
+            (e for notes in self.files.values() for e in notes),
+            key=self.order
+        )
+
+
+def notes(count):
+    # warnings spread over FILES files, several per line as after a full
+    # typecheck, in the order ENSIME reports them
+    per_file = max(count // FILES, 1)
+    return [{
+        'file': '/src/main/scala/pkg/File%d.scala' % (i // per_file),
+        'line': (i % per_file) // 4 + 1,
+        'col': (i % 4) * 10 + 1,
+        'msg': 'value discarding: %d' % i,
+        'severity': {'typehint': 'NoteWarning' if i % 5 else 'NoteError'}
+    } for i in range(count)]
+
+
+def run(entry, store, payloads):
+    timings = []
+    start = time.time()
+    notes = store()
+    for i in range(0, len(payloads), BATCH):
+        notes.add(entry.fromScalaNote(p) for p in payloads[i:i + BATCH])
+    timings.append(time.time() - start)
+
+    start = time.time()
+    listed = [e.to_dict() for e in notes.entries()]
+    timings.append(time.time() - start)
+
+    # a typecheck of one file replaces its notes
+    filename = payloads[0]['file']
+    again = [p for p in payloads if p['file'] == filename]
+    start = time.time()
+    notes.remove(filename)
+    notes.add(entry.fromScalaNote(p) for p in again)
+    [e.to_dict() for e in notes.entries()]
+    timings.append(time.time() - start)
+    return timings, notes, len(listed)
+
+
+def measure(name, entry, store, payloads):
+    (add, listing, retypecheck), _, count = run(entry, store, payloads)
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        kept = run(entry, store, payloads)[1]
+        peak = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+    print('%-4s %7d entries  add %7.1f ms  list %7.1f ms  '
+          'retypecheck one file %7.1f ms  %s' % (
+              name, count, add * 1000, listing * 1000, retypecheck * 1000,
+              '%6.1f MB' % (peak / 1e6) if peak is not None else ''))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    payloads = notes(count)
+    measure('old', OldQuickfixEntry, OldScalaNotes, payloads)
+    measure('new', QuickfixEntry, ScalaNotes, payloads)
+
+
+if __name__ == '__main__':
+    main()
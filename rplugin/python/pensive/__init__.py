@@ -1,17 +1,106 @@
-import json
+import atexit
 import os.path
-from threading import Thread
-from websocket import create_connection
-import Queue
+import re
+import time
+from functools import partial
+from threading import Lock, Thread
 import neovim
+import codec
 import ensime
-import logging
+import launcher
+from recorder import Recorder
+from stats import Stats
+import logs
+from pending import (
+    PendingRequest, PendingRequests, RequestCancelled, ServerError,
+    DEFAULT_TIMEOUT)
+from utils import PriorityInbox, ResponseCache, decode
+from completion import CompletionCache, MAX_SHOWN, narrow
+from prefetch import Prefetcher, identifiers
+from implicits import (
+    HIGHLIGHT_GROUP, VIEWPORT_REGIONS, ImplicitCache, split_regions)
+from typecheck import TypecheckScheduler
+from projects import ProjectPool, find_root, shutdown
+from symbols import SymbolIndex
+from transport import (
+    MuxTransport, WebsocketTransport, TransportClosed, socket_path)
 
-PENSIVE_SOCKET_LOG = 'pensive.log'
+# how long, in milliseconds, a single main loop callback may spend
+# dispatching queued messages before yielding back to the editor
+DEFAULT_DRAIN_BUDGET = 20
+# milliseconds of quiet after an edit or save before auto typechecking
+DEFAULT_TYPECHECK_DELAY = 500
+# the buffer an automatic typecheck is for and whether those are enabled
+AUTO_TYPECHECK_STATE = (
+    '[expand("<afile>:p"), str2nr(expand("<abuf>")), '
+    'get(g:, "pensive_auto_typecheck", 0)]'
+)
+# notifications that only need handling once however often they are queued
+COALESCED_NOTIFICATIONS = (
+    'IndexerReadyEvent',
+    'AnalyzerReadyEvent',
+    'FullTypeCheckCompleteEvent'
+)
+# notifications that make queued ones pointless
+SUPERSEDING_NOTIFICATIONS = {
+    'ClearAllScalaNotesEvent': (
+        'ClearAllScalaNotesEvent', 'NewScalaNotesEvent'
+    )
+}
+# what completion needs in one round trip: the mode, the buffer and the
+# line up to the cursor along with the cursor's 0-based character offset
+COMPLETION_STATE = (
+    "[mode(), expand('%:p'), bufnr('%'), b:changedtick, "
+    "strpart(getline('.'), 0, col('.') - 1), "
+    "strchars(join(getline(1, line('.') - 1) + "
+    "[strpart(getline('.'), 0, col('.') - 1)], \"\\n\"))]"
+)
+IDENTIFIER_END = re.compile(r'[\w$]*$', re.UNICODE)
+# the visible part of the buffer and the offset it starts at, for prefetching
+VIEWPORT_STATE = (
+    "[get(g:, 'pensive_prefetch', 0), expand('%:p'), bufnr('%'), "
+    "b:changedtick, &modified, line('.'), line('w0'), "
+    "strchars(join(getline(1, line('w0') - 1), \"\\n\")), "
+    "getline('w0', 'w$')]"
+)
+# the Scala files open in this editor, a shared multiplexer only forwards
+# their notes
+SCALA_BUFFERS = (
+    "map(filter(getbufinfo({'buflisted': 1}), "
+    "'fnamemodify(v:val.name, \":e\") ==# \"scala\"'), 'v:val.name')"
+)
+# characters of the identifier before the cursor, see capture_word
+WORD_BEFORE_CURSOR = (
+    "strchars(matchstr(strpart(getline('.'), 0, col('.') - 1), '\\k*$'))")
 
 
-def calculate_offset(line_offset, colnum):
-    return int(line_offset) + int(colnum) - 1
+def capture_positions(vim, starts=('.',), ends=(), extra=()):
+    # a single round trip for the buffer state and the 0-based character
+    # offsets ENSIME expects; `starts` give the offset before the character
+    # at each mark and `ends` the offset after it, which also copes with
+    # multibyte characters and linewise visual marks; the values of the
+    # `extra` expressions are appended
+    def offsets(marks, through):
+        return (
+            "map([%s], 'strchars(join(getline(1, v:val[1] - 1) + "
+            "[strpart(getline(v:val[1]), 0, v:val[2]%s)], \"\\n\"))')" % (
+                ', '.join('getpos("%s")' % m for m in marks),
+                '' if through else ' - 1')
+        )
+    return vim.eval(
+        "[expand('%%:p'), bufnr('%%'), b:changedtick, &modified, %s, %s%s]" % (
+            offsets(starts, False), offsets(ends, True),
+            ''.join(', ' + e for e in extra))
+    )
+
+
+def capture_word(vim):
+    # the buffer state, the offset of the start of the identifier under the
+    # cursor and the identifier; lookups anywhere in an identifier share a
+    # cache entry
+    filename, bufnr, tick, modified, (offset,), _, before, word = \
+        capture_positions(vim, extra=(WORD_BEFORE_CURSOR, "expand('<cword>')"))
+    return filename, bufnr, tick, modified, offset - before, word
 
 
 @neovim.plugin
@@ -19,149 +108,862 @@ class EnsimeClient(object):
     def __init__(self, vim):
         self.vim = vim
         self.plugin_dir = os.path.dirname(os.path.realpath(__file__))
-        self.project_dir = os.path.abspath(os.path.curdir)
-        self.is_running = False
-        self.ws = None
-        self.thread = None
-        self.queue = Queue.Queue()
+        # files outside of any project are sent to this one
+        self.project_dir = (find_root(os.path.curdir) or
+                            os.path.abspath(os.path.curdir))
+        self.projects = ProjectPool()
+        self.recorder = None
+        self.queue = PriorityInbox(
+            COALESCED_NOTIFICATIONS, SUPERSEDING_NOTIFICATIONS)
+        self.drain_budget = DEFAULT_DRAIN_BUDGET / 1000.0
+        self.drain_lock = Lock()
+        self.drain_scheduled = False
+        self.index_lock = Lock()
         self.call_id = 0
-        self.history = {}
+        self.pending = PendingRequests()
+        self.responses = ResponseCache()
+        self.completions = CompletionCache()
+        # (key, PendingRequest) of the completion list being fetched
+        self.completing = None
+        self.prefetcher = Prefetcher(self.prefetch, self.cancel)
+        self.implicits = ImplicitCache()
+        # (bufnr, filename, regions) last shown with implicit highlighting
+        self.implicit_view = None
+        self.namespace = None
+        self.stats = Stats()
+        self.send_contents = False
+        self.sent_ticks = {}
+        self.bufnrs = {}
+        self.typechecks = TypecheckScheduler(
+            DEFAULT_TYPECHECK_DELAY / 1000.0,
+            self.vim.session.threadsafe_call,
+            self.send_typecheck,
+            self.supersede_notes)
 
-        self.logger = logging.getLogger(__name__)
-        self.logger.addHandler(
-            logging.FileHandler(
-                os.path.join(self.plugin_dir, PENSIVE_SOCKET_LOG), 'w')
-        )
-        self.logger.level = logging.DEBUG
+        self.logger = logs.configure()
+        # servers started from here do not outlive the plugin host
+        atexit.register(self.projects.close)
+
+    def project(self, filename=None):
+        # the project `filename` belongs to, by default the current buffer's
+        if filename is None:
+            filename = self.vim.eval("expand('%:p')")
+        if not filename:
+            return self.projects.get(self.project_dir)
+        return self.projects.for_file(filename, self.project_dir)
+
+    @neovim.command("EnsimeStart", sync=False)
+    def command_start(self):
+        project = self.project()
+        if project.server is not None and project.server.poll() is None:
+            self.echo('ENSIME server is already running')
+            return
+        self.run_async(
+            partial(self.start_server, project),
+            lambda _: self.open(project),
+            partial(self.report, 'ENSIME failed to start'))
+        self.echo('Starting ENSIME for %s' % project.root)
+
+    def start_server(self, project):
+        # classpath resolution and the server startup can take a while,
+        # returns once the server has written its port file
+        started = int(time.time())
+        project.server = launcher.launch(
+            os.path.join(project.root, '.ensime'))
+        port_file = os.path.join(project.root, '.ensime_cache/http')
+        while project.server.poll() is None:
+            if (os.path.exists(port_file) and
+                    os.path.getmtime(port_file) >= started):
+                return
+            time.sleep(0.5)
+        raise launcher.LauncherError(
+            'server exited with status %d' % project.server.returncode)
+
+    @neovim.command("EnsimeStop", sync=False)
+    def command_stop(self):
+        # disconnects, and stops the server when it was started from here
+        project = self.project()
+        if not project.is_running and project.server is None:
+            self.echo('ENSIME is not running for %s' % project.root)
+            return
+        self.pending.fail_all(TransportClosed(project.root), project.root)
+        self.run_async(
+            partial(shutdown, *project.detach()),
+            lambda _: self.echo('ENSIME stopped for %s' % project.root),
+            partial(self.report, 'ENSIME failed to stop'))
+
+    @neovim.autocmd('VimLeavePre', sync=True)
+    def autocmd_leave(self):
+        self.projects.close()
+
+    def run_async(self, work, done=None, failed=None):
+        # command handlers must return right away, so blocking network and
+        # file I/O runs on a worker thread; `done` receives the result and
+        # `failed` the exception, both back on the main loop
+        def run():
+            try:
+                result = work()
+            except Exception as e:
+                self.logger.debug("async exception: %s", e)
+                if failed is not None:
+                    self.vim.session.threadsafe_call(failed, e)
+                return
+            if done is not None:
+                self.vim.session.threadsafe_call(done, result)
+        thread = Thread(name='pensive-io', target=run)
+        thread.daemon = True
+        thread.start()
 
-    @neovim.command("EnsimeConnect")
+    def report(self, prefix, error):
+        self.echo('%s: %s' % (prefix, str(error)))
+
+    def echo(self, message):
+        self.vim.command("echom '%s'" % message.replace("'", "''"))
+
+    @neovim.command("EnsimeConnect", sync=False)
     def connect(self):
-        if not self.is_running:
-            self.port = int(open(
-                os.path.join(self.project_dir, ".ensime_cache/http"), "r"
-            ).read().strip())
-            self.url = "ws://127.0.0.1:{}/websocket".format(self.port)
-            self.options = {
-                'subprotocols': ['jerky'],
-                'enable_multithread': True
-            }
-            self.ws = create_connection(
-                self.url,
-                **self.options
-            )
-            self.is_running = True
-            self.thread = Thread(
-                name='recv',
-                target=self.recv)
-            self.thread.daemon = True
-            self.thread.start()
-            self.send(ensime.ConnectionInfo().request())
+        project = self.project()
+        if not project.is_running and not project.connecting:
+            self.open(project)
         else:
             self.logger.debug("attempted to start while already running")
-            pass
-            print 'already running'
+            self.echo('already running')
+
+    def open(self, project):
+        # connections are opened by EnsimeConnect or by the first request
+        # for a project, in both cases the options are read again
+        self.drain_budget = float(self.vim.vars.get(
+            'pensive_drain_budget', DEFAULT_DRAIN_BUDGET)) / 1000.0
+        self.typechecks.delay = float(self.vim.vars.get(
+            'pensive_typecheck_delay', DEFAULT_TYPECHECK_DELAY)) / 1000.0
+        self.send_contents = bool(
+            self.vim.vars.get('pensive_send_contents', 0))
+        self.configure_logging()
+        record = self.vim.vars.get('pensive_record')
+        if record and self.recorder is None:
+            self.recorder = Recorder(record)
+        project.connecting = True
+        files = self.vim.eval(SCALA_BUFFERS)
+        self.run_async(
+            partial(self.open_transport, project, files),
+            partial(self.connected, project),
+            partial(self.connect_failed, project))
+
+    def configure_logging(self):
+        level, path = self.vim.eval(
+            "[get(g:, 'pensive_log_level', 'off'), "
+            "expand(get(g:, 'pensive_log_file', ''))]")
+        try:
+            self.logger = logs.configure(level, path)
+        except (ValueError, IOError) as e:
+            self.report('ENSIME logging not configured', e)
+
+    def open_transport(self, project, files):
+        # runs on a worker thread, see run_async
+        on_message = partial(self.recv, project)
+        on_disconnect = partial(self.disconnected, project)
+        on_connect = partial(self.reconnected, project)
+        if os.path.exists(socket_path(project.root)):
+            # a multiplexer is running for this project, share its
+            # connection and only receive the notifications that are
+            # rendered here, notes only for the files open here
+            transport = MuxTransport(
+                project.root,
+                on_message,
+                on_disconnect,
+                on_connect,
+                [t for t, h in ensime.ResponseType.handlers.items()
+                 if issubclass(h, ensime.Notification)],
+                [f for f in files
+                 if (find_root(f) or self.project_dir) == project.root])
+            try:
+                transport.start()
+                return transport
+            except Exception as e:
+                self.logger.debug("multiplexer unavailable: %s", e)
+        transport = WebsocketTransport(
+            project.root,
+            on_message,
+            on_disconnect,
+            on_connect)
+        transport.start()
+        return transport
+
+    def connected(self, project, transport):
+        project.transport = transport
+        project.connecting = False
+        project.touch()
+        command = ensime.ConnectionInfo()
+        command.request()
+        self.send(command, project=project)
+        waiting, project.waiting = project.waiting, []
+        for call_id, typehint, message in waiting:
+            self.write(project, call_id, typehint, message)
+
+    def connect_failed(self, project, error):
+        project.connecting = False
+        waiting, project.waiting = project.waiting, []
+        for call_id, _, _ in waiting:
+            request = self.pending.pop(call_id)
+            if request is not None:
+                request.set_error(error)
+            self.stats.discard(call_id)
+        self.report('ENSIME connect failed for %s' % project.root, error)
+
+    def close_idle(self):
+        # closing waits for the websocket close handshake, so off the loop
+        for project in self.projects.idle():
+            self.logger.debug("closing idle connection: %s", project)
+            transport, project.transport = project.transport, None
+            self.run_async(transport.close)
 
-    def send(self, message):
+    def send(self, command, timeout=DEFAULT_TIMEOUT, render=True,
+             project=None, ordered=False):
+        # `command` is a request object from `ensime` whose `request` has
+        # already been built. The returned PendingRequest can be waited on
+        # or given callbacks by other plugin code, with `render=False` the
+        # reply is only delivered to those and not shown in the editor.
+        # It goes to `project`, by default the current buffer's, whose
+        # connection is opened first when needed. An `ordered` reply does
+        # not overtake the notifications received before it.
+        if project is None:
+            project = self.project()
+        self.pending.expire()
+        self.close_idle()
         self.call_id += 1
         filtered_message = {
-            k: v for k, v in message.iteritems()
+            k: v for k, v in command._request.iteritems()
         }
 
-        command_name = filtered_message.pop('__name__')
+        filtered_message.pop('__name__', None)
         payload = {
             'callId': self.call_id,
             'req': filtered_message
         }
-        self.history[self.call_id] = command_name
-        self.ws.send(json.dumps(payload))
-        return message
+        request = self.pending.add(PendingRequest(
+            self.call_id, command, timeout, render, project.root))
+        if ordered:
+            self.queue.keep_order(self.call_id)
+            request.add_done_callback(lambda r: self.queue.forget(r.call_id))
+        message = codec.dumps(payload)
+        project.touch()
+        if project.is_running:
+            self.write(
+                project, self.call_id, filtered_message.get('typehint'),
+                message)
+        else:
+            project.waiting.append(
+                (self.call_id, filtered_message.get('typehint'), message))
+            if not project.connecting:
+                self.open(project)
+        return request
 
-    def recv(self):
-        while self.is_running:
-            try:
-                message = self.ws.recv()
-                parsed = json.loads(message)
-                self.queue.put(parsed)
-                self.vim.session.threadsafe_call(self.update)
-            except Exception as e:
-                self.logger.debug("recv exception: %s" % str(e))
+    def write(self, project, call_id, typehint, message):
+        try:
+            project.transport.send(message)
+            self.stats.sent(call_id, typehint, len(message))
+            if self.recorder is not None:
+                self.recorder.record('send', message)
+        except Exception as e:
+            request = self.pending.pop(call_id)
+            if request is not None:
+                request.set_error(e)
+            self.vim.command("echom 'ENSIME is not connected'")
+
+    def cancel(self, call_id):
+        return self.pending.cancel(call_id)
+
+    def send_cached(self, command, key, bufnr, modified, *args):
+        # answers from the response cache when the same query was made
+        # against the same buffer state, otherwise sends and caches the reply
+        response = self.responses.get(key)
+        if response is not None:
+            response.run(self.vim)
+            return None
+        request = self.prefetcher.claim(key)
+        if request is not None:
+            # already being prefetched, shown once the reply is in
+            request.render = True
+            return request
+        return self.fetch(command, key, bufnr, modified, True, *args)
+
+    def fetch(self, command, key, bufnr, modified, render, *args):
+        filename, tick = key[0], key[3]
+        project = self.project(filename)
+        command.request(
+            self.source_file(filename, bufnr, (tick, modified)), *args)
+        request = self.send(command, render=render, project=project)
+        request.add_done_callback(partial(self.cache_response, key))
+        # only what ENSIME said about the file as saved is worth keeping
+        request.add_done_callback(partial(
+            self.index_symbols, project, None if int(modified) else key))
+        return request
+
+    def prefetch(self, item):
+        key, bufnr, modified = item
+        if key in self.responses:
+            return None
+        if key[4] == ensime.TypeAtPoint.typehint:
+            command = ensime.TypeAtPoint()
+        else:
+            command = ensime.SymbolAtPoint()
+        return self.fetch(command, key, bufnr, modified, False, key[1])
+
+    def source_file(self, filename, bufnr, state=None):
+        # with g:pensive_send_contents ENSIME analyses the unsaved buffer
+        # rather than the file on disk, the contents are fetched in a single
+        # call and only sent again once changedtick has moved
+        if not self.send_contents or bufnr is None:
+            return filename
+        if state is None:
+            state = self.vim.eval(
+                "[getbufvar({0}, 'changedtick'), "
+                "getbufvar({0}, '&modified')]".format(bufnr))
+        tick, modified = state
+        if not int(modified):
+            self.sent_ticks.pop(filename, None)
+            return filename
+        if self.sent_ticks.get(filename) == tick:
+            return filename
+        contents = self.vim.eval(
+            'join(getbufline({0}, 1, "$"), "\\n")'.format(bufnr))
+        self.sent_ticks[filename] = tick
+        return ensime.source_file(filename, contents + '\n')
+
+    def cache_response(self, key, request):
+        if request.error is None and request.result is not None:
+            self.responses.put(key, request.result)
+
+    def symbol_index(self, project):
+        # opened on first use; it is file I/O, so only from worker threads
+        with self.index_lock:
+            if project.symbols is None:
+                project.symbols = SymbolIndex.forProject(project.root)
+            return project.symbols
+
+    def index_symbols(self, project, key, request):
+        # declarations seen in replies, and for a SymbolAtPoint at `key`
+        # where it went, are kept for goto without ENSIME; positions in
+        # unsaved contents sent to ENSIME are not
+        result = request.result
+        entries = []
+        use = None
+        if isinstance(result, ensime.SymbolInfo):
+            entries.append((result.name, result.local_name, result.decl_pos))
+            if key is not None and key[4] == ensime.SymbolAtPoint.typehint:
+                use = (key[0], key[1], result.name, result.target())
+            result = result.type
+        if isinstance(result, ensime.BasicTypeInfo):
+            entries.append((result.full_name, result.name, result.pos))
+        entries = [
+            e for e in entries
+            if getattr(e[2], 'file', None) not in self.sent_ticks
+        ]
+        if use is not None and (
+                getattr(use[3], 'file', None) in self.sent_ticks):
+            use = None
+        if entries or use is not None:
+            self.run_async(partial(self.store_symbols, project, entries, use))
+
+    def store_symbols(self, project, entries, use=None):
+        # runs on a worker thread, returns how many declarations were stored
+        index = self.symbol_index(project)
+        if use is not None:
+            index.add_use(*use)
+        return index.add(entries)
+
+    def resolve_indexed(self, project, filename, offset):
+        # runs on a worker thread
+        return self.symbol_index(project).resolve(filename, offset)
+
+    def find_indexed(self, project, filename, word):
+        # runs on a worker thread
+        return self.symbol_index(project).find(word, filename)
+
+    def goto_symbol(self, key, bufnr, modified, word, indexed=None):
+        if indexed is not None:
+            ensime.SourcePosition.fromJson(indexed.position()).goto(self.vim)
+            return
+        request = self.send_cached(
+            ensime.SymbolAtPoint(), key, bufnr, modified, key[1])
+        if request is not None:
+            request.add_done_callback(partial(
+                self.goto_fallback, self.project(key[0]), key[0], word))
+
+    def goto_fallback(self, project, filename, word, request):
+        # without an answer from ENSIME the one indexed declaration of the
+        # name is the best guess there is, and is shown as such
+        if request.error is None or isinstance(
+                request.error, RequestCancelled):
+            return
+        self.run_async(
+            partial(self.find_indexed, project, filename, word),
+            partial(self.goto_guess, word))
+
+    def goto_guess(self, word, symbol):
+        if symbol is not None:
+            self.echo('ENSIME unavailable, going to the indexed declaration '
+                      'of %s' % word)
+            ensime.SourcePosition.fromJson(symbol.position()).goto(self.vim)
+
+    def send_typecheck(self, filename):
+        self.responses.invalidate(filename)
+        command = ensime.TypecheckFile()
+        command.request(
+            self.source_file(filename, self.bufnrs.get(filename)))
+        # the notes the server sent before replying are still suppressed
+        # when they are handled, see supersede_notes
+        return self.send(
+            command, project=self.project(filename), ordered=True)
+
+    def supersede_notes(self, filename, queued):
+        notes = ensime.scala_notes[self.project(filename).root]
+        if queued:
+            # a newer typecheck of the file is waiting to be sent
+            notes.suppress(filename)
+            return
+        notes.unsuppress(filename)
+        if notes.remove(filename):
+            self.vim.call(
+                'setqflist',
+                [e.to_dict() for e in ensime.scala_notes.entries()],
+                'r')
+
+    def recv(self, project, message):
+        arrived = time.time()
+        project.touch()
+        self.logger.debug("receive: %s", message)
+        if self.recorder is not None:
+            self.recorder.record('recv', message)
+        try:
+            parsed = codec.loads(message)
+        except Exception as e:
+            self.logger.debug("recv exception: %s", e)
+            return
+        parsed['timing'] = (arrived, time.time())
+        # notes and queued notifications are kept apart per project
+        parsed['project'] = project.root
+        self.queue.put(parsed)
+        self.stats.received(len(message), len(self.queue))
+        self.schedule_update()
+
+    def disconnected(self, project, error):
+        # called from the receiving thread, which then keeps trying to
+        # reconnect with exponential backoff
+        self.logger.debug("disconnected: %s %s", project, error)
+        self.vim.session.threadsafe_call(self.fail_pending, project)
+
+    def fail_pending(self, project):
+        def in_project(filename):
+            return self.project(filename) is project
+        self.typechecks.cancel(in_project)
+        for filename in [f for f in self.sent_ticks if in_project(f)]:
+            del self.sent_ticks[filename]
+        url = project.transport.url if project.transport else project.root
+        self.pending.fail_all(TransportClosed(url), project.root)
+        self.echo('ENSIME disconnected from %s, reconnecting' % project.root)
+
+    def reconnected(self, project):
+        self.logger.debug("reconnected: %s", project)
+        self.vim.session.threadsafe_call(self.connection_restored, project)
+
+    def connection_restored(self, project):
+        self.responses.clear()
+        command = ensime.ConnectionInfo()
+        command.request()
+        self.send(command, project=project)
+        self.echo('ENSIME reconnected to %s' % project.root)
+
+    def schedule_update(self):
+        # at most one drain callback is pending on the main loop at a time,
+        # messages arriving in the meantime are picked up by that callback
+        with self.drain_lock:
+            if self.drain_scheduled:
+                return
+            self.drain_scheduled = True
+        self.vim.session.threadsafe_call(self.update)
 
     def update(self):
+        with self.drain_lock:
+            self.drain_scheduled = False
+
+        self.pending.expire()
+        deadline = time.time() + self.drain_budget
+        while True:
+            result = self.queue.get()
+            if result is None:
+                return
+            self.dispatch(result)
+            if time.time() >= deadline:
+                break
+
+        if self.queue:
+            self.schedule_update()
+
+    def dispatch(self, result):
+        dispatched = time.time()
         try:
-            result = self.queue.get(True, 0.1)
-            self.logger.debug("receive: %s" % json.dumps(result))
             call_id = result.get('callId')
             if call_id is not None:
-                command_name = self.history[call_id]
-                self.logger.debug("command_name: %s" % str(command_name))
-                command = getattr(ensime, command_name)()
-                self.logger.debug("command: %s" % str(command))
-
-                if getattr(command, 'response', None):
-                    self.logger.debug("command: executing response")
-                    command.response(
-                        result['payload']
-                    ).run(self.vim)
-                    self.logger.debug("command: executed response")
+                request = self.pending.pop(call_id)
+                if request is None:
+                    self.stats.discard(call_id)
+                    self.logger.debug(
+                        "dropping reply for unknown, expired or cancelled "
+                        "callId: %s", call_id)
+                    return
+                self.logger.debug("request: %s", request)
+
+                payload = result['payload']
+                if payload.get('typehint') == 'EnsimeServerError':
+                    # neither rendered nor cached, callbacks see the error
+                    request.set_error(ServerError(payload.get('description')))
+                    if request.render:
+                        self.report('ENSIME error', request.error)
                 else:
-                    self.logger("Warning: command has no 'response'")
+                    self.respond(request, payload)
             else:
-                ensime.Notification.fromJson(
-                    result['payload']
-                ).run(self.vim)
+                notification = ensime.Notification.fromJson(
+                    result['payload'])
+                if notification is not None:
+                    notification.run(self.vim, result['project'])
+
+        except Exception as e:
+            self.logger.debug("update exception: %s", e)
+        self.stats.handled(result, dispatched)
 
-        except Queue.Empty:
-            pass
+    def respond(self, request, payload):
+        try:
+            response = request.command.response(payload)
         except Exception as e:
-            self.logger.debug("update exception: %s" % str(e))
-        return result
+            request.set_error(e)
+            raise
+        request.set_result(response)
+        if request.render and getattr(response, 'run', None):
+            self.logger.debug("command: executing response")
+            response.run(self.vim)
+            self.logger.debug("command: executed response")
 
-    @neovim.command("EnsimeConnectionInfo", sync=True)
+    @neovim.command("EnsimeConnectionInfo", sync=False)
     def command_connection_info(self):
-        command = ensime.ConnectionInfo().request()
+        command = ensime.ConnectionInfo()
+        command.request()
         self.send(command)
 
-    @neovim.command("EnsimeTypecheckFile", sync=True)
-    def command_typecheck_file(self):
-        filename = self.vim.current.buffer.name
-        command = ensime.TypecheckFile().request(filename)
+    @neovim.command("EnsimeUnloadAll", sync=False)
+    def command_unload_all(self):
+        self.responses.clear()
+        self.completions.clear()
+        self.implicits.clear()
+        self.sent_ticks.clear()
+        command = ensime.UnloadAll()
+        command.request()
         self.send(command)
 
+    @neovim.command("EnsimeTypecheckFile", sync=False)
+    def command_typecheck_file(self):
+        buffer = self.vim.current.buffer
+        self.bufnrs[buffer.name] = buffer.number
+        self.typechecks.now(buffer.name)
+
+    @neovim.autocmd(
+        'BufWritePost', pattern='*.scala', eval=AUTO_TYPECHECK_STATE)
+    def autocmd_typecheck(self, args):
+        filename, bufnr, enabled = args
+        if int(enabled) and self.project(filename).is_running:
+            self.bufnrs[filename] = bufnr
+            self.typechecks.request(filename)
+
+    @neovim.autocmd(
+        'TextChanged,InsertLeave', pattern='*.scala',
+        eval=AUTO_TYPECHECK_STATE)
+    def autocmd_typecheck_edit(self, args):
+        # without the buffer contents ENSIME would only check the unchanged
+        # file on disk again
+        if self.send_contents:
+            self.autocmd_typecheck(args)
+
+    @neovim.autocmd('BufEnter', pattern='*.scala', eval='expand("<afile>:p")')
+    def autocmd_watch(self, filename):
+        project = self.project(filename)
+        if project.is_running:
+            project.transport.watch(filename)
+
+    @neovim.autocmd('BufDelete', pattern='*.scala', eval='expand("<afile>:p")')
+    def autocmd_unwatch(self, filename):
+        project = self.project(filename)
+        if project.is_running:
+            project.transport.unwatch(filename)
+
+    @neovim.autocmd('CursorHold', pattern='*.scala', eval=VIEWPORT_STATE)
+    def autocmd_prefetch(self, args):
+        # while the cursor rests, types and symbols of the identifiers on
+        # screen are looked up so the commands can answer from the cache
+        (enabled, filename, bufnr, tick, modified, cursor, first,
+         first_offset, lines) = args
+        if not int(enabled) or not self.project(filename).is_running:
+            return
+        if first > 1:
+            first_offset += 1
+        offsets = identifiers(
+            [decode(l) for l in lines], first_offset, first, cursor)
+        self.prefetcher.start(
+            ((filename, offset, offset, tick, command.typehint),
+             bufnr, modified)
+            for offset in offsets
+            for command in (ensime.TypeAtPoint, ensime.SymbolAtPoint))
+
+    @neovim.autocmd(
+        'CursorMoved,CursorMovedI,TextChanged,TextChangedI', pattern='*.scala')
+    def autocmd_cancel_prefetch(self):
+        self.prefetcher.cancel()
+
+    @neovim.command("EnsimeImplicits", sync=False)
+    def command_implicits(self):
+        enabled = not int(self.vim.vars.get('pensive_implicits', 0))
+        self.vim.vars['pensive_implicits'] = int(enabled)
+        if enabled:
+            self.vim.command('highlight default link %s Underlined' %
+                             HIGHLIGHT_GROUP)
+            self.autocmd_implicits(self.vim.eval(VIEWPORT_REGIONS))
+        elif self.implicit_view is not None:
+            self.render_implicits(self.implicit_view[0], [])
+            self.implicit_view = None
+
+    @neovim.autocmd(
+        'BufEnter,CursorHold,InsertLeave,TextChanged', pattern='*.scala',
+        eval=VIEWPORT_REGIONS)
+    def autocmd_implicits(self, state):
+        # only regions on screen are asked for, and of those only the ones
+        # edited since their implicit info was cached
+        if not state:
+            return
+        filename, bufnr, tick, modified, first_line, first_offset, lines = \
+            state
+        project = self.project(filename)
+        if not project.is_running:
+            return
+        regions = split_regions(
+            [decode(l) for l in lines], first_line, first_offset)
+        self.implicit_view = (bufnr, filename, regions)
+        # ENSIME's offsets would be into the file on disk, so an edited
+        # buffer only shows what was cached unless its contents are sent
+        stale = int(modified) and not self.send_contents
+        for region in regions:
+            key = region.key(filename)
+            if (stale or key in self.implicits.in_flight or
+                    self.implicits.get(key)):
+                continue
+            self.implicits.in_flight.add(key)
+            command = ensime.ImplicitInfo()
+            command.request(
+                self.source_file(filename, bufnr, (tick, modified)),
+                region.start, region.end)
+            request = self.send(command, render=False, project=project)
+            request.add_done_callback(
+                partial(self.implicits_received, key, region))
+        self.show_implicits()
+
+    def implicits_received(self, key, region, request):
+        if request.error is not None or request.result is None:
+            self.implicits.in_flight.discard(key)
+            return
+        self.implicits.put(key, region, request.result.infos)
+        view = self.implicit_view
+        if view is not None and any(r.key(view[1]) == key for r in view[2]):
+            self.show_implicits()
+
+    def show_implicits(self):
+        bufnr, filename, regions = self.implicit_view
+        highlights = []
+        for region in regions:
+            infos = self.implicits.get(region.key(filename))
+            if infos:
+                highlights.extend(region.highlights(infos))
+        self.render_implicits(bufnr, highlights)
+
+    def render_implicits(self, bufnr, highlights):
+        # a single call replaces all of the buffer's implicit highlights
+        if self.namespace is None:
+            self.namespace = self.vim.api.create_namespace('pensive_implicits')
+        calls = [['nvim_buf_clear_namespace', [bufnr, self.namespace, 0, -1]]]
+        calls.extend(
+            ['nvim_buf_add_highlight',
+             [bufnr, self.namespace, HIGHLIGHT_GROUP, line, start, end]]
+            for line, start, end in highlights)
+        self.vim.api.call_atomic(calls)
+
+    @neovim.command("EnsimeImplicitInfo", sync=False)
+    def command_implicit_info(self):
+        filename, bufnr, tick, modified, (offset,), _ = capture_positions(
+            self.vim)
+        view = self.implicit_view
+        if view is not None and view[0] == bufnr:
+            for region in view[2]:
+                infos = self.implicits.get(region.key(filename))
+                if infos is not None and region.start <= offset <= region.end:
+                    offset -= region.start
+                    found = [i for start, end, i in infos
+                             if start <= offset <= end]
+                    self.echo('; '.join(i.description for i in found) or
+                              'no implicits')
+                    return
+        command = ensime.ImplicitInfo()
+        command.request(
+            self.source_file(filename, bufnr, (tick, modified)),
+            offset, offset)
+        self.send(command, project=self.project(filename))
+
     @neovim.command("EnsimeTypeAtPoint", sync=False)
     def command_type_at_point(self):
-        filename = self.vim.current.buffer.name
-        line_number, col_number = self.vim.eval('getpos(".")')[1:3]
-        line_byte_pos = self.vim.eval('line2byte({0})'.format(line_number))
-        command = ensime.TypeAtPoint().request(
-            filename, calculate_offset(line_byte_pos, col_number))
-        self.send(command)
+        filename, bufnr, tick, modified, offset, _ = capture_word(self.vim)
+        command = ensime.TypeAtPoint()
+        self.send_cached(
+            command, (filename, offset, offset, tick, command.typehint),
+            bufnr, modified, offset)
 
     @neovim.command("EnsimeTypeOfSelection", sync=False)
     def command_type_of_selection(self):
-        filename = self.vim.current.buffer.name
-        start_line_number, start_col_number = self.vim.eval(
-            'getpos("\'<")')[1:3]
-        end_line_number, end_col_number = self.vim.eval('getpos("\'>")')[1:3]
-        start_line_byte_pos = self.vim.eval('line2byte({0})'.format(
-            start_line_number))
-        end_line_byte_pos = self.vim.eval('line2byte({0})'.format(
-            end_line_number))
-        command = ensime.TypeOfSelection().request(
-            filename,
-            calculate_offset(start_line_byte_pos, start_col_number),
-            calculate_offset(end_line_byte_pos, end_col_number - 1))
-        self.send(command)
+        filename, bufnr, tick, modified, (start,), (end,) = \
+            capture_positions(self.vim, ("'<",), ("'>",))
+        command = ensime.TypeOfSelection()
+        self.send_cached(
+            command, (filename, start, end, tick, command.typehint),
+            bufnr, modified, start, end)
 
     @neovim.command("EnsimeSymbolAtPoint", sync=False)
     def command_symbol_at_point(self):
-        filename = self.vim.current.buffer.name
-        line_number, col_number = self.vim.eval('getpos(".")')[1:3]
-        line_byte_pos = self.vim.eval('line2byte({0})'.format(line_number))
-        command = ensime.SymbolAtPoint().request(
-            filename, calculate_offset(line_byte_pos, col_number)
-        )
-        self.logger.debug('sending: %s' % json.dumps(command))
-        self.send(command)
+        filename, bufnr, tick, modified, offset, word = capture_word(
+            self.vim)
+        key = (filename, offset, offset, tick, ensime.SymbolAtPoint.typehint)
+        goto = partial(self.goto_symbol, key, bufnr, modified, word)
+        if key in self.responses or int(modified):
+            goto()
+            return
+        # where ENSIME went from this very identifier before is used as
+        # long as neither file has changed since, otherwise it is asked
+        self.run_async(
+            partial(self.resolve_indexed, self.project(filename), filename,
+                    offset),
+            goto,
+            lambda _: goto())
+
+    @neovim.command("EnsimeIndexSymbols", nargs='+', sync=False)
+    def command_index_symbols(self, args):
+        # adds the public symbols matching the keywords to the local index
+        project = self.project()
+        command = ensime.PublicSymbolSearch()
+        command.request(args)
+        request = self.send(command, render=False, project=project)
+        request.add_done_callback(partial(self.symbols_found, project))
+
+    def symbols_found(self, project, request):
+        if request.error is not None:
+            self.report('ENSIME symbol search failed', request.error)
+            return
+        self.run_async(
+            partial(self.store_symbols, project, [
+                (s.name, s.local_name, s.pos) for s in request.result.syms]),
+            lambda count: self.echo('%d symbols indexed' % count),
+            partial(self.report, 'ENSIME symbols not indexed'))
+
+    @neovim.function("EnsimeComplete", sync=True)
+    def function_complete(self, args):
+        # for insert mode mappings: <C-r>=EnsimeComplete()<CR>
+        self.complete(automatic=False)
+        return ''
+
+    @neovim.autocmd(
+        'TextChangedI', pattern='*.scala',
+        eval='get(g:, "pensive_auto_complete", 0)')
+    def autocmd_complete(self, enabled):
+        if int(enabled):
+            self.complete()
+
+    def complete(self, automatic=True, fetch=True):
+        # candidates are fetched once per completion point and narrowed
+        # locally from then on; automatic completion only starts at a
+        # member access
+        mode, filename, bufnr, tick, before, offset = self.vim.eval(
+            COMPLETION_STATE)
+        if mode != 'i' or not filename:
+            return
+        before = decode(before)
+        prefix = IDENTIFIER_END.search(before).group(0)
+        start = offset - len(prefix)
+        key = self.completions.key(
+            filename, start, tick, before[:len(before) - len(prefix)])
+        candidates = self.completions.get(key)
+        if candidates is not None:
+            items = [c.to_dict() for c in narrow(candidates, prefix)]
+            if items:
+                column = len(before.encode('utf-8')) - len(
+                    prefix.encode('utf-8')) + 1
+                self.vim.call('complete', column, items[:MAX_SHOWN])
+            return
+        member = not prefix and before.endswith('.')
+        if not fetch or (automatic and not member):
+            return
+        if self.completing is not None:
+            if self.completing[0] == key:
+                return
+            # the user has moved on, its reply would be stale
+            self.cancel(self.completing[1].call_id)
+        # ENSIME is asked for everything at the start of the identifier,
+        # the prefix itself is matched here
+        contents = decode(self.vim.eval('join(getline(1, "$"), "\\n")'))
+        contents = contents[:start] + contents[offset:] + '\n'
+        command = ensime.Completions()
+        command.request(ensime.source_file(filename, contents), start)
+        request = self.send(
+            command, render=False, project=self.project(filename))
+        self.completing = (key, request)
+        request.add_done_callback(partial(self.completions_received, key))
+
+    def completions_received(self, key, request):
+        if self.completing is None or self.completing[1] is not request:
+            return
+        self.completing = None
+        if request.error is None and request.result is not None:
+            self.completions.put(key, request.result.completions)
+            self.complete(fetch=False)
+
+    @neovim.command("EnsimeCacheStats", sync=False)
+    def command_cache_stats(self):
+        self.vim.command(
+            "echom 'responses: %(entries)d cached, %(hits)d hits, "
+            "%(misses)d misses'" % self.responses.stats())
+
+    @neovim.command("EnsimeStats", nargs='?', complete='file', sync=False)
+    def command_stats(self, args):
+        # with a path the statistics are also written there as JSON
+        snapshot = self.stats.snapshot()
+        snapshot['responses'] = self.responses.stats()
+        # payloads no response class could decode, by typehint
+        snapshot['unknown'] = dict(
+            (str(t), n) for t, n in ensime.ResponseType.unknown.items())
+        for line in self.stats.lines(snapshot):
+            self.echo(line)
+        if args:
+            path = os.path.expanduser(args[0])
+            self.run_async(
+                partial(self.dump_stats, path, snapshot),
+                lambda _: self.echo('ENSIME stats written to %s' % path),
+                partial(self.report, 'ENSIME stats not written'))
+
+    @neovim.command("EnsimeLog", sync=False)
+    def command_log(self):
+        lines = logs.recent(self.logger)
+        if not lines:
+            self.echo('no log records held in memory, see g:pensive_log_level')
+            return
+        self.vim.command('new')
+        self.vim.command('setlocal buftype=nofile bufhidden=wipe noswapfile')
+        self.vim.current.buffer[:] = lines
+
+    def dump_stats(self, path, snapshot):
+        with open(path, 'w') as fh:
+            fh.write(codec.dumps(snapshot))
 
 
 def main():
@@ -0,0 +1,45 @@
+import json
+
+
+def _orjson():
+    import orjson
+    return (
+        'orjson',
+        orjson.loads,
+        lambda obj: orjson.dumps(obj).decode('utf-8')
+    )
+
+
+def _ujson():
+    import ujson
+    return (
+        'ujson',
+        ujson.loads,
+        lambda obj: ujson.dumps(obj, escape_forward_slashes=False)
+    )
+
+
+def _simplejson():
+    import simplejson
+    return 'simplejson', simplejson.loads, simplejson.dumps
+
+
+def _stdlib():
+    return 'json', json.loads, json.dumps
+
+
+CODECS = [_orjson, _ujson, _simplejson, _stdlib]
+
+
+def available():
+    codecs = []
+    for codec in CODECS:
+        try:
+            codecs.append(codec())
+        except ImportError:
+            pass
+    return codecs
+
+
+# the fastest JSON library that is installed, falling back to the stdlib
+name, loads, dumps = available()[0]
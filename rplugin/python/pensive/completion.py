@@ -0,0 +1,69 @@
+from utils import LRUCache
+
+# candidate lists kept, one per completion point
+CACHE_SIZE = 32
+# complete-items handed to Vim at once
+MAX_SHOWN = 200
+
+
+def fuzzy_key(name, prefix):
+    # None unless the characters of `prefix` appear in `name` in order,
+    # ignoring case; otherwise a sort key ranking exact prefixes first,
+    # then prefixes ignoring case, then subsequences with fewer gaps
+    if name.startswith(prefix):
+        return (0, 0)
+    lower, wanted = name.lower(), prefix.lower()
+    if lower.startswith(wanted):
+        return (1, 0)
+    gaps = 0
+    last = -1
+    for char in wanted:
+        found = lower.find(char, last + 1)
+        if found < 0:
+            return None
+        if found != last + 1:
+            gaps += 1
+        last = found
+    return (2, gaps)
+
+
+def narrow(candidates, prefix):
+    # the CompletionInfos matching `prefix`, best first; ties go to the
+    # server's relevance and then to shorter names
+    ranked = []
+    for candidate in candidates:
+        key = fuzzy_key(candidate.name, prefix)
+        if key is not None:
+            ranked.append((key, -candidate.relevance, len(candidate.name),
+                           candidate.name, len(ranked), candidate))
+    ranked.sort(key=lambda r: r[:5])
+    return [r[-1] for r in ranked]
+
+
+class CompletionCache(object):
+    # candidate lists keyed by (filename, start, changedtick when completion
+    # started at `start`), so while the user keeps typing at the same point
+    # the list is narrowed locally rather than asked for again
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.lists = LRUCache(maxsize)
+        # (key, the line up to `start` when completion started there)
+        self.current = None
+
+    def key(self, filename, start, tick, context):
+        # `context` is the line up to `start`; once it is edited, e.g. the
+        # receiver of a member access, the point is a new one
+        current = self.current
+        if (current is None or current[0][:2] != (filename, start) or
+                current[1] != context):
+            self.current = current = ((filename, start, tick), context)
+        return current[0]
+
+    def get(self, key):
+        return self.lists.get(key)
+
+    def put(self, key, candidates):
+        self.lists.put(key, candidates)
+
+    def clear(self):
+        self.lists.clear()
+        self.current = None
@@ -1,25 +1,56 @@
+import logging
 import os
-import json
+from collections import Counter
 from operator import attrgetter
-from utils import QuickfixEntry
+from logs import LOGGER_NAME
+from utils import QuickfixEntry, LineIndex, LineIndexCache, ProjectNotes
 
-import logging
 
+# shared across requests so repeated usage lookups do not re-read files
+line_indexes = LineIndexCache()
+# notes received since the last ClearAllScalaNotesEvent of each project
+scala_notes = ProjectNotes()
 
-PENSIVE_COMMAND_LOG = 'pensive-command.log'
+logger = logging.getLogger(LOGGER_NAME)
 
 
 class ResponseType(object):
+    __slots__ = ()
+    # typehints decoded by a class, see register_handlers
+    typehints = ()
+    handlers = {}
+    # payloads nothing could decode, counted by typehint
+    unknown = Counter()
+
     @classmethod
     def fromJson(cls, payload):
+        if payload is None:
+            return None
+        typehint = payload.get('typehint')
+        handler = ResponseType.handlers.get(typehint)
+        if handler is not None and issubclass(handler, cls):
+            return handler(payload)
+        # payloads without a registered typehint, e.g. positions that only
+        # carry their fields, are matched by content
         for subclass in cls._handlers():
             if subclass.handles(payload):
                 return subclass(payload)
+        ResponseType.unknown[typehint] += 1
+        if ResponseType.unknown[typehint] == 1:
+            logger.warning("no handler for typehint %s in %s, ignoring it",
+                           typehint, cls.__name__)
+        return None
+
+    @classmethod
+    def handles(cls, payload):
+        return False
 
     @classmethod
     def _handlers(cls):
         for c in cls.__subclasses__():
             yield c
+            for d in c._handlers():
+                yield d
 
 
 class VoidResponse(object):
@@ -42,34 +73,53 @@ class ERangePositions(object):
             ERangePosition(pos) for pos in payload['positions']
         ]
 
-    def _create_quickfix_entry(self, pos):
-        offset = pos.offset
-        fh = open(pos.file, 'r')
-        for line_num, line in enumerate(fh, 1):
-            line_len = len(line)
-            if (offset - line_len) < 0:
-                break
-            offset = offset - line_len
-        fh.close()
+    def _modified_buffers(self, vim):
+        # one round trip for the names of all buffers with unsaved changes,
+        # their contents are what ENSIME analysed rather than the file
+        modified = vim.eval(
+            "map(filter(getbufinfo({'bufloaded': 1}), 'v:val.changed'), "
+            "'v:val.name')"
+        )
+        if not modified:
+            return {}
+        return dict(
+            (b.name, b) for b in vim.buffers if b.name in modified
+        )
+
+    def _line_indexes(self, vim):
+        buffers = self._modified_buffers(vim)
+        indexes = {}
+        for path in set(pos.file for pos in self.positions):
+            if path in buffers:
+                indexes[path] = LineIndex.fromBuffer(buffers[path][:])
+            else:
+                indexes[path] = line_indexes.get(path)
+        return indexes
+
+    def _create_quickfix_entry(self, pos, index):
+        line_num, col = index.position(pos.offset)
         d = {
-            'filename': str(
-                pos.file.replace(
-                    os.path.abspath(os.path.curdir) + '/', ''
-                )
+            'filename': pos.file.replace(
+                os.path.abspath(os.path.curdir) + '/', ''
             ),
             'lnum': line_num,
-            'col': offset,
-            'text': line
+            'col': col,
+            'text': index.line(line_num)
         }
         return d
 
     def run(self, vim):
+        indexes = self._line_indexes(vim)
         qflist = [
-            self._create_quickfix_entry(pos) for pos in self.positions
+            self._create_quickfix_entry(pos, indexes[pos.file])
+            for pos in sorted(
+                self.positions, key=attrgetter('file', 'offset')
+            )
+            if indexes[pos.file] is not None
         ]
 
         if qflist:
-            vim.eval("setloclist(0, %s)" % str(qflist))
+            vim.call('setloclist', 0, qflist)
             vim.command("lopen")
 
     @classmethod
@@ -77,7 +127,31 @@ class ERangePositions(object):
         return cls(payload)
 
 
+class lazy(object):
+    # decodes a member of the raw payload on first access and keeps the
+    # result in `slot`
+    def __init__(self, slot, decode):
+        self.slot = slot
+        self.decode = decode
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.decode(obj._payload)
+            setattr(obj, self.slot, value)
+            return value
+
+
+def field(key):
+    return property(lambda self: self._payload.get(key))
+
+
 class TypeInfo(ResponseType):
+    __slots__ = ()
+
     def output_buffer(self, vim):
         return [
             b for b in vim.buffers if b.name.endswith("pensive")
@@ -88,18 +162,23 @@ class TypeInfo(ResponseType):
 
 
 class BasicTypeInfo(TypeInfo):
+    typehints = ('BasicTypeInfo',)
+    __slots__ = ('_payload', '_type_args', '_pos')
+
+    decl_as = None
+    members = None
+    outer_type_id = None
+
     def __init__(self, payload):
-        self.name = payload['name']
-        # self.type_id = payload['typeId']
-        self.decl_as = None
-        self.full_name = payload['fullName']
-        self.type_args = [
-            TypeInfo.fromJson(t) for t in payload['typeArgs']
-        ]
-        self.members = None
-        pos = payload.get('pos')
-        self.pos = SourcePosition.fromJson(pos) if 'pos' in payload else None
-        self.outer_type_id = None
+        self._payload = payload
+
+    name = field('name')
+    full_name = field('fullName')
+    type_args = lazy('_type_args', lambda payload: [
+        TypeInfo.fromJson(t) for t in payload['typeArgs']
+    ])
+    pos = lazy('_pos', lambda payload: SourcePosition.fromJson(
+        payload.get('pos')))
 
     def _get_type_args(self):
         if not self.type_args:
@@ -114,45 +193,55 @@ class BasicTypeInfo(TypeInfo):
         # self.output_buffer(vim).append(self.name + self._get_type_args())
         vim.command("echom '%s'" % result)
 
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'BasicTypeInfo'
-
 
 class ArrowTypeInfo(TypeInfo):
+    typehints = ('ArrowTypeInfo',)
+    __slots__ = ('_payload', '_result_type')
+
+    param_sections = None
+    decl_as = None
+    type_args = None
+    members = None
+    pos = None
+    outer_type_id = None
+
     def __init__(self, payload):
-        self.name = payload['name']
-        self.full_name = payload['resultType']['fullName']
-        # self.type_id = payload['typeId']
-        self.result_type = TypeInfo.fromJson(payload['resultType'])
-        self.param_sections = None
-        self.decl_as = None
-        self.type_args = None
-        self.members = None
-        self.pos = None
-        self.outer_type_id = None
+        self._payload = payload
+
+    name = field('name')
+    full_name = property(lambda self: self._payload['resultType']['fullName'])
+    result_type = lazy('_result_type', lambda payload: TypeInfo.fromJson(
+        payload['resultType']))
 
     def run(self, vim):
         # self.output_buffer(vim).append(self.name)
         vim.command("echom '%s'" % self.name)
 
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'ArrowTypeInfo'
-
 
 class SourcePosition(ResponseType):
+    __slots__ = ()
+
     def goto(self, vim):
         pass
 
 
 class EmptySourcePosition(SourcePosition):
-    @classmethod
-    def handles(cls, payload):
+    typehints = ('EmptySourcePosition',)
+    __slots__ = ()
+
+    def __init__(self, payload):
+        pass
+
+    def __nonzero__(self):
         return False
 
+    __bool__ = __nonzero__
+
 
 class OffsetSourcePosition(SourcePosition):
+    typehints = ('OffsetSourcePosition',)
+    __slots__ = ('file', 'offset')
+
     def __init__(self, payload):
         self.file = payload['file']
         self.offset = payload['offset']
@@ -167,6 +256,9 @@ class OffsetSourcePosition(SourcePosition):
 
 
 class LineSourcePosition(SourcePosition):
+    typehints = ('LineSourcePosition',)
+    __slots__ = ('file', 'line')
+
     def __init__(self, payload):
         self.file = payload['file']
         self.line = payload['line']
@@ -181,40 +273,44 @@ class LineSourcePosition(SourcePosition):
 
 
 class SymbolInfo(object):
-    def __init__(self, payload):
-        self.plugin_dir = os.path.dirname(os.path.realpath(__file__))
-        self.logger = logging.getLogger(__name__)
-        self.logger.addHandler(
-            logging.FileHandler(
-                os.path.join(self.plugin_dir, PENSIVE_COMMAND_LOG), 'w')
-        )
-        self.logger.level = logging.DEBUG
-        self.name = payload.get('name')
-        self.logger.debug("name: %s" % self.name)
-        self.local_name = payload.get('localName')
-        self.logger.debug("local_name: %s" % self.local_name)
-        self.decl_pos = SourcePosition.fromJson(payload.get('declPos'))
-        self.logger.debug("decl_pos: %s" % self.decl_pos)
-        self.type = TypeInfo.fromJson(payload.get('type'))
-        self.logger.debug("type: %s" % self.type)
-        self.is_callable = payload.get('isCallable')
-        self.logger.debug("is_callable: %s" % self.is_callable)
-        self.owner_type_id = payload.get('ownerTypeId')
-        self.logger.debug("owner_type_id: %s" % self.owner_type_id)
+    __slots__ = ('_payload', '_decl_pos', '_type')
 
-    def run(self, vim):
+    def __init__(self, payload):
+        self._payload = payload
+
+    name = field('name')
+    local_name = field('localName')
+    is_callable = field('isCallable')
+    owner_type_id = field('ownerTypeId')
+    decl_pos = lazy('_decl_pos', lambda payload: SourcePosition.fromJson(
+        payload.get('declPos')))
+    type = lazy('_type', lambda payload: TypeInfo.fromJson(
+        payload.get('type')))
+
+    def target(self):
+        # the position run goes to, None when there is none
         # if the symbol declaration is the same as the type position
         # just go to the declaration position
         df = getattr(self.decl_pos, 'file', False)
         tf = getattr(self.type, 'file', False)
 
         if df and tf and df == tf:
-            self.decl_pos.goto(vim)
-        else:
-            if self.type and self.type.pos:
-                self.type.pos.goto(vim)
-            elif self.decl_pos:
-                self.decl_pos.goto(vim)
+            return self.decl_pos
+        if self.type and self.type.pos:
+            return self.type.pos
+        return self.decl_pos or None
+
+    def run(self, vim):
+        target = self.target()
+        if target is not None:
+            target.goto(vim)
+
+
+def source_file(path, contents=None):
+    # an ENSIME SourceFileInfo, requests accept it wherever a file is taken
+    if contents is None:
+        return path
+    return {'file': path, 'contents': contents}
 
 
 def add_class_name(d, cls):
@@ -231,8 +327,8 @@ class UnloadAll(object):
         self._request = {"typehint": self.typehint}
         return add_class_name(self._request, self)
 
-    def response(self, content):
-        self._response = json.loads(content)
+    def response(self, payload):
+        self._response = VoidResponse(payload)
         return self._response
 
 
@@ -245,8 +341,9 @@ class ConnectionInfo(object):
         self._request = {"typehint": self.typehint}
         return add_class_name(self._request, self)
 
-    def response(self):
-        pass
+    def response(self, payload):
+        self._response = VoidResponse(payload)
+        return self._response
 
 
 class TypecheckAll(object):
@@ -276,8 +373,8 @@ class TypecheckFile(object):
         return add_class_name(self._request, self)
 
     def response(self, payload):
-        # self._response = NewScalaNotesEvent(payload)
-        self._response = Notification.fromJson(payload)
+        # the notes arrive as NewScalaNotesEvents
+        self._response = VoidResponse(payload)
         return self._response
 
 
@@ -353,25 +450,122 @@ class UsesOfSymbolAtPoint(object):
         return self._response
 
 
-# class CompletionsReq(object):
-#     typehint = "CompletionsReq"
-#     _request = None
-#     _response = None
+class SymbolSearchResult(object):
+    # a TypeSearchResult or MethodSearchResult
+    __slots__ = ('name', 'local_name', 'pos')
+
+    def __init__(self, payload):
+        self.name = payload['name']
+        self.local_name = payload.get('localName')
+        self.pos = SourcePosition.fromJson(payload.get('pos'))
+
+
+class SymbolSearchResults(object):
+    def __init__(self, payload):
+        self.syms = [SymbolSearchResult(s) for s in payload.get('syms', [])]
 
-#     def request(self, path, pos):
-#         self._request = {
-#             "typehint": self.typehint,
-#             "file": path,
-#             "point": pos
-#         }
-#         return add_class_name(self._request, self)
+    def run(self, vim):
+        vim.command("echom '%d symbols found'" % len(self.syms))
 
-#     def response(self, payload):
-#         self._response = CompletionInfos(payload)
-#         return self._response
 
-#     def response(self, payload):
-#         return self._response
+class PublicSymbolSearch(object):
+    typehint = "PublicSymbolSearchReq"
+    _request = None
+    _response = None
+
+    def request(self, keywords, max_results=1000):
+        self._request = {
+            "typehint": self.typehint,
+            "keywords": keywords,
+            "maxResults": max_results
+        }
+        return add_class_name(self._request, self)
+
+    def response(self, payload):
+        self._response = SymbolSearchResults(payload)
+        return self._response
+
+
+class CompletionInfo(object):
+    __slots__ = ('name', 'type_name', 'relevance', 'to_insert')
+
+    def __init__(self, payload):
+        self.name = payload['name']
+        self.type_name = (payload.get('typeInfo') or {}).get('name', '')
+        self.relevance = payload.get('relevance', 0)
+        self.to_insert = payload.get('toInsert')
+
+    def to_dict(self):
+        # a Vim complete-item, `equal` keeps Vim from dropping the fuzzy
+        # matches that do not start with the typed prefix
+        return {
+            'word': self.to_insert or self.name,
+            'abbr': self.name,
+            'menu': self.type_name,
+            'icase': 1,
+            'dup': 1,
+            'equal': 1
+        }
+
+
+class CompletionInfoList(object):
+    def __init__(self, payload):
+        self.prefix = payload.get('prefix', '')
+        self.completions = [
+            CompletionInfo(c) for c in payload.get('completions', [])
+        ]
+
+    def run(self, vim):
+        # shown by the client, which narrows the list as the user types
+        pass
+
+
+class Completions(object):
+    typehint = "CompletionsReq"
+    _request = None
+    _response = None
+
+    def request(self, path, pos, max_results=1000):
+        if not isinstance(path, dict):
+            path = {'file': path}
+        self._request = {
+            "typehint": self.typehint,
+            "fileInfo": path,
+            "point": pos,
+            "maxResults": max_results,
+            "caseSens": False,
+            "reload": 'contents' in path
+        }
+        return add_class_name(self._request, self)
+
+    def response(self, payload):
+        self._response = CompletionInfoList(payload)
+        return self._response
+
+
+class Implicit(object):
+    # an ImplicitConversionInfo or ImplicitParamInfo
+    __slots__ = ('start', 'end', 'description')
+
+    def __init__(self, payload):
+        self.start = payload['start']
+        self.end = payload['end']
+        fun = (payload.get('fun') or {}).get('name', '')
+        if payload.get('typehint') == 'ImplicitParamInfo':
+            params = [p.get('name', '') for p in payload.get('params', [])]
+            self.description = 'implicit %s passed to %s' % (
+                ', '.join(params), fun)
+        else:
+            self.description = 'implicit conversion %s' % fun
+
+
+class ImplicitInfos(object):
+    def __init__(self, payload):
+        self.infos = [Implicit(i) for i in payload.get('infos', [])]
+
+    def run(self, vim):
+        text = '; '.join(i.description for i in self.infos) or 'no implicits'
+        vim.command("echom '%s'" % text.replace("'", "''"))
 
 
 class ImplicitInfo(object):
@@ -388,95 +582,70 @@ class ImplicitInfo(object):
         return add_class_name(self._request, self)
 
     def response(self, payload):
-        self._response = payload
+        self._response = ImplicitInfos(payload)
         return self._response
 
 
 class Notification(ResponseType):
+    # run with the root of the project whose server sent it
     def __init__(self, parsed_command):
         self.parsed_command = parsed_command
 
 
 class NewScalaNotesEvent(Notification):
+    typehints = ('NewScalaNotesEvent',)
+
     def __init__(self, parsed_command):
         super(NewScalaNotesEvent, self).__init__(parsed_command)
         self.notes = self.parsed_command['notes']
 
-    def _create_quickfix_entry(self, pos):
-        severities = {
-            'NoteError': 'E',
-            'NoteWarning': 'W'
-        }
-
-        d = {
-            'filename': str(pos['file']),
-            'lnum': pos['line'],
-            'col': pos['col'],
-            'text': str(pos['msg']),
-            'type': severities.get(pos['severity']['typehint'], '')
-        }
-
-        return d
-
-    def run(self, vim):
-        current_qf_list = vim.eval('getqflist()')
-        deref_qf_list = []
-
-        for d in current_qf_list:
-            d['file'] = vim.eval('bufname(%s)' % d['bufnr'])
-            deref_qf_list.append(d)
-
-        qflist = [
-            QuickfixEntry.fromVim(i) for i in deref_qf_list
-        ] + [
+    def run(self, vim, project):
+        added = scala_notes[project].add(
             QuickfixEntry.fromScalaNote(i) for i in self.notes
-        ]
-
-        qflist = sorted(
-            list(set(qflist)),
-            key=attrgetter('filename', 'line_number', 'severity')
         )
 
-        if qflist:
-            vim.eval("setqflist(%s)" % str([i.to_dict() for i in qflist]))
-
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'NewScalaNotesEvent'
+        if added:
+            vim.call('setqflist', [i.to_dict() for i in added], 'a')
 
 
 class ClearScalaNotes(Notification):
-    def run(self, vim):
-        vim.command("echom 'Cleared Scala notes'")
-        vim.eval('setqflist([])')
+    typehints = ('ClearAllScalaNotesEvent',)
 
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'ClearAllScalaNotesEvent'
+    def run(self, vim, project):
+        # the notes of other projects stay
+        scala_notes[project].clear()
+        vim.command("echom 'Cleared Scala notes'")
+        vim.call('setqflist', [e.to_dict() for e in scala_notes.entries()],
+                 'r')
 
 
 class IndexerReady(Notification):
-    def run(self, vim):
-        vim.command("echom 'Indexer Ready'")
+    typehints = ('IndexerReadyEvent',)
 
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'IndexerReadyEvent'
+    def run(self, vim, project):
+        vim.command("echom 'Indexer Ready'")
 
 
 class AnalyzerReady(Notification):
-    def run(self, vim):
-        vim.command("echom 'Analyzer Ready'")
+    typehints = ('AnalyzerReadyEvent',)
 
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'AnalyzerReadyEvent'
+    def run(self, vim, project):
+        vim.command("echom 'Analyzer Ready'")
 
 
 class FullTypeCheckComplete(Notification):
-    def run(self, vim):
+    typehints = ('FullTypeCheckCompleteEvent',)
+
+    def run(self, vim, project):
         vim.command("echom 'Full Typecheck Complete'")
 
-    @classmethod
-    def handles(cls, payload):
-        return payload.get('typehint', '') == 'FullTypeCheckCompleteEvent'
+
+def register_handlers():
+    # maps every typehint in the response hierarchy to its class once, so
+    # decoding a message is a single lookup
+    for handler in ResponseType._handlers():
+        for typehint in handler.typehints:
+            ResponseType.handlers[typehint] = handler
+
+
+register_handlers()
@@ -0,0 +1,81 @@
+import hashlib
+
+from utils import LineIndex, LRUCache
+
+# lines per region, the unit implicit info is requested and cached in
+REGION_LINES = 50
+# regions whose implicit info is kept
+CACHE_SIZE = 256
+HIGHLIGHT_GROUP = 'PensiveImplicit'
+
+# the buffer state and the lines of the regions covering the window, when
+# g:pensive_implicits is set
+VIEWPORT_REGIONS = (
+    "get(g:, 'pensive_implicits', 0) ? ["
+    "expand('%:p'), bufnr('%'), b:changedtick, &modified, "
+    "(line('w0') - 1) / {0} * {0} + 1, "
+    "strchars(join(getline(1, (line('w0') - 1) / {0} * {0}), \"\\n\")), "
+    "getline((line('w0') - 1) / {0} * {0} + 1, "
+    "((line('w$') - 1) / {0} + 1) * {0})] : []"
+).format(REGION_LINES)
+
+
+class Region(object):
+    __slots__ = ('first_line', 'start', 'end', 'lines', 'digest')
+
+    def __init__(self, first_line, start, lines):
+        text = u'\n'.join(lines)
+        self.first_line = first_line
+        self.start = start
+        self.end = start + len(text)
+        self.lines = lines
+        self.digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def key(self, filename):
+        # an edit inside the region, or one above it that moves it, makes
+        # for a new key and so for a new request
+        return (filename, self.first_line, self.digest)
+
+    def highlights(self, infos):
+        # (0-based line, start byte column, end byte column) for the
+        # (start, end, Implicit) infos, whose offsets are relative to the
+        # region; spans over several lines are highlighted on the first
+        index = LineIndex.fromBuffer(self.lines)
+        for start, end, _ in infos:
+            line, column = index.position(start)
+            end_line, end_column = index.position(end)
+            yield (self.first_line + line - 2, column - 1,
+                   end_column - 1 if end_line == line else -1)
+
+
+def split_regions(lines, first_line, first_offset):
+    # `lines` start at `first_line`, at character offset `first_offset`,
+    # which is where a region starts
+    regions = []
+    offset = first_offset + (1 if first_line > 1 else 0)
+    for i in range(0, len(lines), REGION_LINES):
+        chunk = lines[i:i + REGION_LINES]
+        region = Region(first_line + i, offset, chunk)
+        regions.append(region)
+        offset = region.end + 1
+    return regions
+
+
+class ImplicitCache(object):
+    # relative (start, end, Implicit) infos per region key
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.regions = LRUCache(maxsize)
+        self.in_flight = set()
+
+    def get(self, key):
+        return self.regions.get(key)
+
+    def put(self, key, region, infos):
+        self.in_flight.discard(key)
+        self.regions.put(key, [
+            (i.start - region.start, i.end - region.start, i) for i in infos
+        ])
+
+    def clear(self):
+        self.regions.clear()
+        self.in_flight.clear()
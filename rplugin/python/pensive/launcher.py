@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+
+ENSIME_VERSION = "2.0.0-SNAPSHOT"
+SBT_VERSION = "0.13.15"
+# seconds a server gets to exit after SIGTERM before it is killed
+STOP_TIMEOUT = 5
+RESOLVERS = [
+    'Resolver.mavenLocal',
+    'Resolver.sonatypeRepo("snapshots")',
+    '"Typesafe repository" at "http://repo.typesafe.com/typesafe/releases/"',
+    '"Akka Repo" at "http://repo.akka.io/repository"',
+]
+
+BUILD_SBT = """import sbt._
+import IO._
+import java.io._
+scalaVersion := "{scala_version}"
+ivyScala := ivyScala.value map {{ _.copy(overrideScalaVersion = true) }}
+// allows local builds of scala
+{resolvers}
+libraryDependencies ++= Seq(
+  "org.ensime" %% "ensime" % "{ensime_version}",
+  "org.scala-lang" % "scala-compiler" % scalaVersion.value force(),
+  "org.scala-lang" % "scala-reflect" % scalaVersion.value force(),
+  "org.scala-lang" % "scalap" % scalaVersion.value force()
+)
+val saveClasspathTask = TaskKey[Unit]("saveClasspath", "Save the classpath to a file")
+saveClasspathTask := {{
+  val managed = (managedClasspath in Runtime).value.map(_.data.getAbsolutePath)
+  val unmanaged = (unmanagedClasspath in Runtime).value.map(_.data.getAbsolutePath)
+  val out = file("{classpath_file}")
+  write(out, (unmanaged ++ managed).mkString(File.pathSeparator))
+}}
+"""
+
+TOKENS = re.compile(
+    r'''\s*(?:(;[^\n]*)|([()])|"((?:[^"\\]|\\.)*)"|([^\s()"]+))''')
+
+
+class LauncherError(Exception):
+    pass
+
+
+def parse_sexp(text):
+    # strings, keywords and symbols become str, lists become lists and
+    # nil becomes None; enough for the .ensime config format
+    stack = [[]]
+    for comment, paren, string, atom in TOKENS.findall(text):
+        if comment:
+            continue
+        elif paren == '(':
+            stack.append([])
+        elif paren == ')':
+            if len(stack) == 1:
+                raise LauncherError("unbalanced ')' in sexp")
+            done = stack.pop()
+            stack[-1].append(done)
+        elif atom:
+            stack[-1].append(None if atom == 'nil' else atom)
+        else:
+            stack[-1].append(re.sub(r'\\(.)', r'\1', string))
+    if len(stack) != 1:
+        raise LauncherError("unbalanced '(' in sexp")
+    return stack[0]
+
+
+def plist(values):
+    return dict(
+        (k[1:], v) for k, v in zip(values[::2], values[1::2])
+        if k and k.startswith(':')
+    )
+
+
+def read_config(path):
+    with open(path, 'r') as fh:
+        parsed = parse_sexp(fh.read())
+    if not parsed or not isinstance(parsed[0], list):
+        raise LauncherError("%s is not an ENSIME config" % path)
+    return plist(parsed[0])
+
+
+def classpath_key(config):
+    key = json.dumps([
+        ENSIME_VERSION,
+        SBT_VERSION,
+        config.get('scala-version'),
+        config.get('java-home'),
+        RESOLVERS
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def resolve_classpath(config):
+    # sbt resolution takes tens of seconds, so the result is cached in the
+    # project's cache dir and only redone when something it depends on
+    # has changed
+    resolution_dir = os.path.join(config['cache-dir'], 'Resolution')
+    classpath_file = os.path.join(resolution_dir, 'classpath')
+    key_file = os.path.join(resolution_dir, 'classpath.key')
+    key = classpath_key(config)
+
+    if os.path.exists(classpath_file) and os.path.exists(key_file):
+        with open(key_file, 'r') as fh:
+            if fh.read().strip() == key:
+                with open(classpath_file, 'r') as cp:
+                    return cp.read().strip()
+
+    project_dir = os.path.join(resolution_dir, 'project')
+    if not os.path.isdir(project_dir):
+        os.makedirs(project_dir)
+    with open(os.path.join(resolution_dir, 'build.sbt'), 'w') as fh:
+        fh.write(BUILD_SBT.format(
+            scala_version=config['scala-version'],
+            ensime_version=ENSIME_VERSION,
+            classpath_file=classpath_file,
+            resolvers='\n'.join('resolvers += %s' % r for r in RESOLVERS)))
+    with open(os.path.join(project_dir, 'build.properties'), 'w') as fh:
+        fh.write('sbt.version=%s\n' % SBT_VERSION)
+
+    # stdin is the plugin host's RPC channel, which sbt must not read from
+    # when it prompts
+    with open(os.path.join(resolution_dir, 'sbt.log'), 'w') as log, \
+            open(os.devnull, 'r') as devnull:
+        status = subprocess.call(
+            ['sbt', 'update', 'saveClasspath'],
+            cwd=resolution_dir, stdin=devnull, stdout=log,
+            stderr=subprocess.STDOUT, close_fds=True)
+    if status != 0 or not os.path.exists(classpath_file):
+        raise LauncherError(
+            "classpath resolution failed, see %s/sbt.log" % resolution_dir)
+
+    with open(key_file, 'w') as fh:
+        fh.write(key)
+    with open(classpath_file, 'r') as fh:
+        return fh.read().strip()
+
+
+def launch(config_path):
+    config = read_config(config_path)
+    for prop in ('java-home', 'cache-dir', 'scala-version'):
+        if not config.get(prop):
+            raise LauncherError(":%s is missing from %s" % (prop, config_path))
+
+    java = os.path.join(config['java-home'], 'bin', 'java')
+    if not os.access(java, os.X_OK):
+        raise LauncherError(
+            ":java-home is not correct, %s is not the java binary." % java)
+    if not os.path.isdir(config['cache-dir']):
+        os.makedirs(config['cache-dir'])
+
+    classpath = os.pathsep.join([
+        os.path.join(config['java-home'], 'lib', 'tools.jar'),
+        resolve_classpath(config)
+    ])
+    env = dict(os.environ, JAVA_HOME=config['java-home'],
+               JDK_HOME=config['java-home'])
+    # nor does the server get the plugin's stdin, sockets or open files
+    with open(os.path.join(config['cache-dir'], 'server.log'), 'w') as log, \
+            open(os.devnull, 'r') as devnull:
+        return subprocess.Popen(
+            [java, '-classpath', classpath] +
+            list(config.get('java-flags') or []) +
+            ['-Densime.config=%s' % config_path, 'org.ensime.server.Server'],
+            cwd=config['cache-dir'], env=env, stdin=devnull, stdout=log,
+            stderr=subprocess.STDOUT, close_fds=True)
+
+
+def stop(process, timeout=STOP_TIMEOUT):
+    # terminates a server started by launch, killing it when it has not
+    # exited after `timeout`; returns its exit status
+    try:
+        if process.poll() is None:
+            process.terminate()
+            deadline = time.time() + timeout
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if process.poll() is None:
+                process.kill()
+    except OSError:
+        # it exited in the meantime
+        pass
+    return process.wait()
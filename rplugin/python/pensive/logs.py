@@ -0,0 +1,69 @@
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+LOGGER_NAME = 'pensive'
+LEVELS = {
+    'off': None,
+    'error': logging.ERROR,
+    'warning': logging.WARNING,
+    'info': logging.INFO,
+    'debug': logging.DEBUG
+}
+FORMAT = '%(asctime)s %(levelname)s %(message)s'
+# a log file is rotated at this size, keeping BACKUP_COUNT old ones
+MAX_BYTES = 1024 * 1024
+BACKUP_COUNT = 2
+# records kept in memory when there is no log file
+RING_SIZE = 1000
+
+
+class RingHandler(logging.Handler):
+    # keeps the latest records unformatted, they are only formatted when
+    # somebody looks at them
+    def __init__(self, capacity=RING_SIZE):
+        logging.Handler.__init__(self)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def lines(self):
+        return [self.format(record) for record in list(self.records)]
+
+
+def configure(level='off', path=None):
+    # replaces whatever was set up before; with `level` off no level is
+    # enabled, so log calls return before building or formatting a record
+    if level not in LEVELS:
+        raise ValueError('unknown log level %r, use one of %s' % (
+            level, ', '.join(sorted(LEVELS))))
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.propagate = False
+
+    if LEVELS[level] is None:
+        logger.addHandler(logging.NullHandler())
+        logger.setLevel(logging.CRITICAL + 1)
+        return logger
+
+    if path:
+        handler = RotatingFileHandler(
+            path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, delay=True)
+    else:
+        handler = RingHandler()
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(LEVELS[level])
+    return logger
+
+
+def recent(logger):
+    # the formatted records held in memory, empty when logging to a file
+    return [
+        line for handler in logger.handlers
+        if isinstance(handler, RingHandler)
+        for line in handler.lines()
+    ]
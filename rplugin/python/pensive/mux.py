@@ -0,0 +1,219 @@
+import os
+import socket
+import sys
+import time
+from threading import Lock, Thread
+
+import codec
+from transport import (
+    LineConnection, WebsocketTransport, socket_path, unix_connection)
+
+# seconds the multiplexer keeps running without any connected editor
+IDLE_TIMEOUT = 600
+# notes are split by file and editors only get those of files they have open
+NOTES = 'NewScalaNotesEvent'
+# asking for a full typecheck means wanting the notes of every file until
+# the typecheck completes
+FULL_TYPECHECK = 'TypecheckAllReq'
+FULL_TYPECHECK_COMPLETE = 'FullTypeCheckCompleteEvent'
+
+
+class MuxClient(object):
+    def __init__(self, mux, sock):
+        self.mux = mux
+        self.connection = LineConnection(sock)
+        # None means every notification is forwarded
+        self.subscriptions = None
+        # files open in the editor, None means the notes of every file
+        self.files = None
+        self.all_notes = False
+        self.lock = Lock()
+
+    def run(self):
+        try:
+            while True:
+                message = self.connection.recv()
+                if not message:
+                    break
+                self.mux.from_client(self, message)
+        except socket.error:
+            pass
+        finally:
+            self.connection.close()
+            self.mux.remove(self)
+
+    def send(self, message):
+        try:
+            with self.lock:
+                self.connection.send(message)
+        except socket.error:
+            self.connection.close()
+
+    def wants(self, typehint):
+        return self.subscriptions is None or typehint in self.subscriptions
+
+    def notes(self, by_file):
+        # the notes of `by_file` this editor renders, None for all of them
+        if self.files is None or self.all_notes:
+            return None
+        return [
+            note for filename in self.files & set(by_file)
+            for note in by_file[filename]
+        ]
+
+    def control(self, parsed):
+        # applies a message that is not a request, returns whether it was one
+        if 'subscribe' in parsed:
+            self.subscriptions = set(parsed['subscribe'])
+        if 'files' in parsed:
+            self.files = set(parsed['files'])
+        if 'open' in parsed:
+            self.files = (self.files or set()) | set(parsed['open'])
+        if 'close' in parsed and self.files is not None:
+            self.files.difference_update(parsed['close'])
+        return 'callId' not in parsed
+
+
+class Multiplexer(object):
+    # holds the only ENSIME connection of a project and shares it between
+    # editors, rewriting callIds so replies reach the editor that asked
+    def __init__(self, project_dir, idle_timeout=IDLE_TIMEOUT):
+        self.socket_path = socket_path(project_dir)
+        self.idle_timeout = idle_timeout
+        self.upstream = WebsocketTransport(
+            project_dir,
+            self.from_server,
+            self.server_disconnected,
+            lambda: None)
+        self.clients = set()
+        self.calls = {}
+        self.call_id = 0
+        self.lock = Lock()
+        self.idle_since = time.time()
+
+    def serve(self):
+        try:
+            unix_connection(self.socket_path).close()
+            return False
+        except socket.error:
+            pass
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.upstream.start()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(16)
+        listener.settimeout(1)
+        try:
+            while not self.idle():
+                try:
+                    sock, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                sock.settimeout(None)
+                client = MuxClient(self, sock)
+                with self.lock:
+                    self.clients.add(client)
+                thread = Thread(name='mux-client', target=client.run)
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+            self.upstream.close()
+        return True
+
+    def idle(self):
+        with self.lock:
+            return (not self.clients and
+                    time.time() - self.idle_since > self.idle_timeout)
+
+    def remove(self, client):
+        with self.lock:
+            self.clients.discard(client)
+            for call_id, (owner, _) in list(self.calls.items()):
+                if owner is client:
+                    del self.calls[call_id]
+            if not self.clients:
+                self.idle_since = time.time()
+
+    def from_client(self, client, message):
+        parsed = codec.loads(message)
+        if client.control(parsed):
+            return
+        if parsed.get('req', {}).get('typehint') == FULL_TYPECHECK:
+            client.all_notes = True
+        with self.lock:
+            self.call_id += 1
+            call_id = self.call_id
+            self.calls[call_id] = (client, parsed['callId'])
+        parsed['callId'] = call_id
+        try:
+            self.upstream.send(codec.dumps(parsed))
+        except Exception as e:
+            self.fail(call_id, e)
+
+    def from_server(self, message):
+        parsed = codec.loads(message)
+        call_id = parsed.get('callId')
+        if call_id is None:
+            typehint = parsed.get('payload', {}).get('typehint')
+            with self.lock:
+                clients = [c for c in self.clients if c.wants(typehint)]
+            if typehint == NOTES:
+                self.send_notes(clients, message, parsed)
+                return
+            for client in clients:
+                if typehint == FULL_TYPECHECK_COMPLETE:
+                    client.all_notes = False
+                client.send(message)
+            return
+        with self.lock:
+            client, parsed['callId'] = self.calls.pop(call_id, (None, None))
+        if client is not None:
+            client.send(codec.dumps(parsed))
+
+    def send_notes(self, clients, message, parsed):
+        # each editor only gets the notes of its files, and nothing when
+        # none of them is among those reported
+        by_file = {}
+        for note in parsed['payload'].get('notes', ()):
+            by_file.setdefault(note.get('file'), []).append(note)
+        for client in clients:
+            notes = client.notes(by_file)
+            if notes is None:
+                client.send(message)
+            elif notes:
+                payload = dict(parsed['payload'], notes=notes)
+                client.send(codec.dumps({'payload': payload}))
+
+    def server_disconnected(self, error):
+        with self.lock:
+            call_ids = list(self.calls)
+        for call_id in call_ids:
+            self.fail(call_id, error)
+
+    def fail(self, call_id, error):
+        with self.lock:
+            client, original = self.calls.pop(call_id, (None, None))
+        if client is not None:
+            client.send(codec.dumps({
+                'callId': original,
+                'payload': {
+                    'typehint': 'EnsimeServerError',
+                    'description': str(error)
+                }
+            }))
+
+
+def main():
+    project_dir = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else '.')
+    if not Multiplexer(project_dir).serve():
+        sys.stderr.write('a multiplexer is already running for %s\n' %
+                         project_dir)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import logging
+import time
+from threading import Event, Lock
+
+from logs import LOGGER_NAME
+
+# seconds after which a request without a reply is given up on
+DEFAULT_TIMEOUT = 30
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class RequestTimeout(Exception):
+    pass
+
+
+class ServerError(Exception):
+    # ENSIME, or the multiplexer on its behalf, failed the request
+    pass
+
+
+class PendingRequest(object):
+    def __init__(self, call_id, command,
+                 timeout=DEFAULT_TIMEOUT, render=True, project=None):
+        self.call_id = call_id
+        self.command = command
+        self.render = render
+        self.project = project
+        self.deadline = time.time() + timeout if timeout else None
+        self.result = None
+        self.error = None
+        self.callbacks = []
+        self.event = Event()
+
+    def __repr__(self):
+        return '[PendingRequest: %s %s]' % (
+            self.call_id, self.command.__class__.__name__)
+
+    def done(self):
+        return self.event.is_set()
+
+    def expired(self, now):
+        return self.deadline is not None and now >= self.deadline
+
+    def add_done_callback(self, callback):
+        # callbacks run on the thread that completes the request, which for
+        # replies from ENSIME is the Neovim main loop
+        if self.done():
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def set_result(self, result):
+        if not self.done():
+            self.result = result
+            self._finish()
+
+    def set_error(self, error):
+        if not self.done():
+            self.error = error
+            self._finish()
+
+    def cancel(self):
+        self.set_error(RequestCancelled(self.call_id))
+
+    def wait(self, timeout=None):
+        # must not be called from the main loop, replies are dispatched there
+        if not self.event.wait(timeout):
+            raise RequestTimeout(self.call_id)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _finish(self):
+        self.event.set()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            # one failing callback must not keep the others from running
+            try:
+                callback(self)
+            except Exception:
+                logger.exception("callback of %s failed", self)
+
+
+class PendingRequests(object):
+    def __init__(self):
+        self.requests = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, request):
+        with self.lock:
+            self.requests[request.call_id] = request
+        return request
+
+    def pop(self, call_id):
+        with self.lock:
+            return self.requests.pop(call_id, None)
+
+    def cancel(self, call_id):
+        request = self.pop(call_id)
+        if request is not None:
+            request.cancel()
+        return request
+
+    def expire(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            expired = [
+                r for r in self.requests.values() if r.expired(now)
+            ]
+            for request in expired:
+                del self.requests[request.call_id]
+        for request in expired:
+            request.set_error(RequestTimeout(request.call_id))
+        return expired
+
+    def fail_all(self, error, project=None):
+        # only the requests sent to `project` when one is given
+        with self.lock:
+            requests = [
+                r for r in self.requests.values()
+                if project is None or r.project == project
+            ]
+            for request in requests:
+                del self.requests[request.call_id]
+        for request in requests:
+            request.set_error(error)
@@ -0,0 +1,78 @@
+import re
+from collections import deque
+
+# prefetches outstanding at once, so interactive requests never queue
+# behind more than a couple of them on the server
+MAX_IN_FLIGHT = 2
+# identifiers looked up each time the cursor rests
+MAX_IDENTIFIERS = 50
+
+IDENTIFIER = re.compile(r'[^\W\d]\w*', re.UNICODE)
+KEYWORDS = frozenset([
+    'abstract', 'case', 'catch', 'class', 'def', 'do', 'else', 'extends',
+    'false', 'final', 'finally', 'for', 'forSome', 'if', 'implicit',
+    'import', 'lazy', 'match', 'new', 'null', 'object', 'override',
+    'package', 'private', 'protected', 'return', 'sealed', 'super', 'this',
+    'throw', 'trait', 'true', 'try', 'type', 'val', 'var', 'while', 'with',
+    'yield'
+])
+
+
+def identifiers(lines, first_offset, first_line, cursor_line,
+                limit=MAX_IDENTIFIERS):
+    # 0-based character offsets of the identifiers in `lines`, which start
+    # at `first_offset` and line `first_line`, nearest to the cursor first
+    found = []
+    offset = first_offset
+    for number, line in enumerate(lines, first_line):
+        for match in IDENTIFIER.finditer(line):
+            if match.group(0) not in KEYWORDS:
+                found.append(
+                    (abs(number - cursor_line), offset + match.start()))
+        offset += len(line) + 1
+    found.sort()
+    return [o for _, o in found[:limit]]
+
+
+class Prefetcher(object):
+    def __init__(self, send, cancel, max_in_flight=MAX_IN_FLIGHT):
+        # `send` issues the lookup for a queued (key, ...) item and returns
+        # its PendingRequest, or None when it is no longer needed; `cancel`
+        # takes the callId of a request to give up on
+        self.send = send
+        self.cancel_request = cancel
+        self.max_in_flight = max_in_flight
+        self.queue = deque()
+        self.in_flight = {}
+
+    def start(self, items):
+        self.cancel()
+        self.queue.extend(items)
+        self._fill()
+
+    def cancel(self):
+        self.queue.clear()
+        in_flight, self.in_flight = self.in_flight, {}
+        for request in in_flight.values():
+            self.cancel_request(request.call_id)
+
+    def claim(self, key):
+        # hands over the prefetch of `key` when one is in flight, it is
+        # then no longer cancelled with the others
+        request = self.in_flight.pop(key, None)
+        if request is not None:
+            self._fill()
+        return request
+
+    def _fill(self):
+        while self.queue and len(self.in_flight) < self.max_in_flight:
+            item = self.queue.popleft()
+            request = self.send(item)
+            if request is None or request.done():
+                continue
+            self.in_flight[item[0]] = request
+            request.add_done_callback(lambda r, key=item[0]: self._done(key))
+
+    def _done(self, key):
+        if self.in_flight.pop(key, None) is not None:
+            self._fill()
@@ -0,0 +1,106 @@
+import os.path
+import time
+from threading import Lock
+
+import launcher
+
+# files or directories that mark the root of an ENSIME project
+PROJECT_MARKERS = ('.ensime', '.ensime_cache')
+# seconds a connection may go unused before it is closed
+IDLE_TIMEOUT = 1800
+
+
+def find_root(path):
+    # the nearest directory at or above `path` holding a project marker
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+        path = os.path.dirname(path)
+    while True:
+        for marker in PROJECT_MARKERS:
+            if os.path.exists(os.path.join(path, marker)):
+                return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def shutdown(transport, server):
+    # closes a connection and stops a server, either may be None; both can
+    # block for a while
+    if transport is not None:
+        transport.close()
+    if server is not None:
+        launcher.stop(server)
+
+
+class Project(object):
+    def __init__(self, root):
+        self.root = root
+        self.transport = None
+        self.server = None
+        self.symbols = None
+        self.connecting = False
+        # messages sent while the connection is being opened, as
+        # (call_id, typehint, message) triples
+        self.waiting = []
+        self.last_used = time.time()
+
+    def __repr__(self):
+        return '[Project: %s]' % self.root
+
+    @property
+    def is_running(self):
+        return self.transport is not None
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def detach(self):
+        # hands over the connection and the server, see shutdown
+        detached = (self.transport, self.server)
+        self.transport = self.server = None
+        return detached
+
+
+class ProjectPool(object):
+    # one Project, and so at most one connection, per project root; files
+    # are mapped to their root once per directory
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.projects = {}
+        self.roots = {}
+        self.lock = Lock()
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.projects.values()))
+
+    def get(self, root):
+        with self.lock:
+            project = self.projects.get(root)
+            if project is None:
+                project = self.projects[root] = Project(root)
+            return project
+
+    def for_file(self, filename, default=None):
+        # the project of `filename`, or of `default` when the file is not
+        # inside one
+        directory = os.path.dirname(os.path.abspath(filename))
+        if directory not in self.roots:
+            self.roots[directory] = find_root(directory)
+        root = self.roots[directory] or default
+        return self.get(root) if root else None
+
+    def idle(self, now=None):
+        # connected projects that have not been used for idle_timeout
+        now = now or time.time()
+        return [
+            p for p in self if p.is_running and
+            now - p.last_used > self.idle_timeout
+        ]
+
+    def close(self):
+        # closes every connection and stops the servers started from here
+        for project in self:
+            shutdown(*project.detach())
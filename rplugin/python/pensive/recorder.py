@@ -0,0 +1,35 @@
+import time
+from threading import Lock
+
+import codec
+
+
+def read_recording(path):
+    # entries are {"t": seconds since the start, "dir": "send" for frames
+    # the editor sent or "recv" for frames ENSIME sent, "msg": raw frame}
+    with open(path, 'r') as fh:
+        return [codec.loads(line) for line in fh if line.strip()]
+
+
+class Recorder(object):
+    # appends every websocket frame of a session to a file, for replaying
+    # it against the fake server in bench/
+    def __init__(self, path):
+        self.fh = open(path, 'a', 1)
+        self.started = time.time()
+        self.lock = Lock()
+
+    def record(self, direction, message):
+        if not isinstance(message, type(u'')):
+            message = message.decode('utf-8')
+        line = codec.dumps({
+            't': round(time.time() - self.started, 6),
+            'dir': direction,
+            'msg': message
+        })
+        with self.lock:
+            self.fh.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.fh.close()
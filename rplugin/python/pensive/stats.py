@@ -0,0 +1,145 @@
+import time
+from collections import OrderedDict, defaultdict, deque
+from threading import Lock
+
+# samples kept per histogram, older ones roll off
+DEFAULT_WINDOW = 1000
+# timestamps of requests whose reply is still outstanding, beyond this the
+# oldest are forgotten as they are most likely expired or cancelled
+MAX_INFLIGHT = 1000
+# wait: sent until the reply frame arrived, decode: arrival until parsed,
+# queue: parsed until dispatched on the main loop, render: dispatched
+# until handled, total: sent (or arrival for notifications) until handled
+PHASES = ('wait', 'decode', 'queue', 'render', 'total')
+
+
+class Histogram(object):
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        values = sorted(self.samples)
+        if not values:
+            return {'count': self.count}
+        n = len(values)
+        return {
+            'count': self.count,
+            'mean': sum(values) / float(n),
+            'p50': values[n // 2],
+            'p95': values[min(n - 1, int(n * 0.95))],
+            'max': values[-1]
+        }
+
+
+class Stats(object):
+    # rolling latency histograms in milliseconds per typehint and phase,
+    # plus message sizes and queue depth; `received` is called from the
+    # transport thread, everything else from the main loop
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.lock = Lock()
+        self.started = time.time()
+        self.inflight = OrderedDict()
+        self.phases = defaultdict(dict)
+        self.sent_sizes = Histogram(window)
+        self.received_sizes = Histogram(window)
+        self.queue_depth = Histogram(window)
+
+    def _add(self, typehint, phase, seconds):
+        histograms = self.phases[typehint]
+        if phase not in histograms:
+            histograms[phase] = Histogram(self.window)
+        histograms[phase].add(seconds * 1000.0)
+
+    def sent(self, call_id, typehint, size):
+        with self.lock:
+            self.inflight[call_id] = (typehint, time.time())
+            if len(self.inflight) > MAX_INFLIGHT:
+                self.inflight.popitem(last=False)
+            self.sent_sizes.add(size)
+
+    def discard(self, call_id):
+        with self.lock:
+            self.inflight.pop(call_id, None)
+
+    def received(self, size, depth):
+        with self.lock:
+            self.received_sizes.add(size)
+            self.queue_depth.add(depth)
+
+    def handled(self, message, dispatched):
+        # `message` carries the arrival and decode times set by the client
+        finished = time.time()
+        arrived, decoded = message.get('timing', (dispatched, dispatched))
+        with self.lock:
+            call_id = message.get('callId')
+            if call_id is not None:
+                typehint, started = self.inflight.pop(
+                    call_id, (None, arrived))
+                if typehint is None:
+                    return
+                self._add(typehint, 'wait', arrived - started)
+            else:
+                typehint = message.get('payload', {}).get(
+                    'typehint', 'unknown')
+                started = arrived
+            self._add(typehint, 'decode', decoded - arrived)
+            self._add(typehint, 'queue', dispatched - decoded)
+            self._add(typehint, 'render', finished - dispatched)
+            self._add(typehint, 'total', finished - started)
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            return {
+                'uptime': uptime,
+                'sent': self.sent_sizes.count,
+                'received': self.received_sizes.count,
+                'received_per_second': (
+                    self.received_sizes.count / uptime if uptime else 0),
+                'inflight': len(self.inflight),
+                'sent_bytes': self.sent_sizes.summary(),
+                'received_bytes': self.received_sizes.summary(),
+                'queue_depth': self.queue_depth.summary(),
+                'latency': dict(
+                    (typehint, dict(
+                        (phase, h.summary()) for phase, h in phases.items()))
+                    for typehint, phases in self.phases.items()
+                )
+            }
+
+    def lines(self, snapshot=None):
+        # a human readable table of `snapshot`
+        snapshot = snapshot or self.snapshot()
+        lines = [
+            '%(sent)d sent, %(received)d received '
+            '(%(received_per_second).1f/s), %(inflight)d in flight' %
+            snapshot
+        ]
+        for name in ('sent_bytes', 'received_bytes', 'queue_depth'):
+            summary = snapshot[name]
+            if summary['count']:
+                lines.append('%-14s p50 %d  p95 %d  max %d' % (
+                    name, summary['p50'], summary['p95'], summary['max']))
+        unknown = snapshot.get('unknown')
+        if unknown:
+            lines.append('ignored typehints: ' + ', '.join(
+                '%s %d' % (typehint, unknown[typehint])
+                for typehint in sorted(unknown)))
+        lines.append('%-32s %-6s %6s %9s %9s %9s' % (
+            'typehint (ms)', 'phase', 'count', 'p50', 'p95', 'max'))
+        for typehint in sorted(snapshot['latency']):
+            phases = snapshot['latency'][typehint]
+            for phase in PHASES:
+                summary = phases.get(phase)
+                if summary is None or not summary['count']:
+                    continue
+                lines.append('%-32s %-6s %6d %9.2f %9.2f %9.2f' % (
+                    typehint, phase, summary['count'], summary['p50'],
+                    summary['p95'], summary['max']))
+        return lines
@@ -0,0 +1,146 @@
+import os
+import sqlite3
+from threading import Lock
+
+INDEX_FILE = 'pensive-symbols.sqlite'
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS symbols (
+    name TEXT NOT NULL,
+    local_name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    offset INTEGER,
+    line INTEGER,
+    mtime REAL,
+    PRIMARY KEY (name, file)
+);
+CREATE INDEX IF NOT EXISTS symbols_local_name ON symbols (local_name);
+CREATE TABLE IF NOT EXISTS uses (
+    file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    mtime REAL,
+    name TEXT,
+    target_file TEXT NOT NULL,
+    target_offset INTEGER,
+    target_line INTEGER,
+    target_mtime REAL,
+    PRIMARY KEY (file, offset)
+);
+"""
+
+
+def mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class IndexedSymbol(object):
+    __slots__ = ('name', 'file', 'offset', 'line', 'mtime')
+
+    def __init__(self, name, file, offset, line, mtime):
+        self.name = name
+        self.file = file
+        self.offset = offset
+        self.line = line
+        self.mtime = mtime
+
+    def fresh(self):
+        # the declaring file has not changed since the position was recorded
+        return self.mtime is not None and mtime(self.file) == self.mtime
+
+    def position(self):
+        # the payload of the source position, for SourcePosition.fromJson
+        if self.offset is not None:
+            return {'file': self.file, 'offset': self.offset}
+        return {'file': self.file, 'line': self.line}
+
+
+class SymbolIndex(object):
+    # declaration positions by fully qualified name, and where ENSIME went
+    # from the identifiers it was asked about, kept under the project's
+    # .ensime_cache so they outlive ENSIME and Neovim restarts; used from
+    # worker threads, one at a time
+    def __init__(self, path):
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def forProject(cls, root):
+        # fails rather than create .ensime_cache, which marks a project
+        return cls(os.path.join(root, '.ensime_cache', INDEX_FILE))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute(
+                'SELECT COUNT(*) FROM symbols').fetchone()[0]
+
+    def add(self, entries):
+        # (name, local name, SourcePosition) triples, those without a name
+        # or a file are skipped; returns how many were stored
+        rows = []
+        for name, local_name, pos in entries:
+            path = getattr(pos, 'file', None)
+            if not name or not path:
+                continue
+            rows.append((
+                name, local_name or name.rsplit('.', 1)[-1], path,
+                getattr(pos, 'offset', None), getattr(pos, 'line', None),
+                mtime(path)))
+        if rows:
+            with self.lock, self.db:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?, ?, ?)',
+                    rows)
+        return len(rows)
+
+    def add_use(self, path, offset, name, pos):
+        # ENSIME took the identifier at `offset` in `path`, as saved, to
+        # `pos`; returns whether it was stored
+        target = getattr(pos, 'file', None)
+        if not target:
+            return False
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO uses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, offset, mtime(path), name, target,
+                 getattr(pos, 'offset', None), getattr(pos, 'line', None),
+                 mtime(target)))
+        return True
+
+    def resolve(self, path, offset):
+        # where ENSIME took the identifier at `offset` in `path`, provided
+        # neither file has changed since; None otherwise
+        with self.lock:
+            row = self.db.execute(
+                'SELECT mtime, name, target_file, target_offset, '
+                'target_line, target_mtime FROM uses '
+                'WHERE file = ? AND offset = ?', (path, offset)).fetchone()
+        if row is None or row[0] is None or row[0] != mtime(path):
+            return None
+        symbol = IndexedSymbol(*row[1:])
+        return symbol if symbol.fresh() else None
+
+    def lookup(self, local_name):
+        with self.lock:
+            return [
+                IndexedSymbol(*row) for row in self.db.execute(
+                    'SELECT name, file, offset, line, mtime FROM symbols '
+                    'WHERE local_name = ?', (local_name,))
+            ]
+
+    def find(self, local_name, filename=None):
+        # the one fresh declaration of `local_name`, when there are several
+        # the one in `filename`; None rather than a guess. Names are not
+        # unique, so this is only a fallback for when ENSIME is unavailable
+        found = [s for s in self.lookup(local_name) if s.fresh()]
+        if len(found) > 1 and filename is not None:
+            found = [s for s in found if s.file == filename]
+        return found[0] if len(found) == 1 else None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
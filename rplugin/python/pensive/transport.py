@@ -0,0 +1,226 @@
+import os.path
+import Queue
+import socket
+from threading import Event, Lock, Thread
+from websocket import create_connection
+import codec
+
+# reconnect delays, in seconds, double from the first up to the last
+INITIAL_BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+
+class TransportClosed(Exception):
+    pass
+
+
+def socket_path(project_dir):
+    # where the multiplexer shared by all editors on a project listens
+    return os.path.join(project_dir, '.ensime_cache', 'pensive.sock')
+
+
+class LineConnection(object):
+    # newline delimited JSON frames over a stream socket, offering the part
+    # of the websocket API the transport uses
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+
+    def recv(self):
+        while b'\n' not in self.buffer:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return b''
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.sock.sendall(data + b'\n')
+
+    def close(self):
+        # shutdown first so a thread blocked in recv sees the close
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+def unix_connection(path, **options):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return LineConnection(sock)
+
+
+class WebsocketTransport(object):
+    def __init__(self, project_dir, on_message, on_disconnect, on_connect,
+                 connect=create_connection):
+        # the callbacks are invoked from the receiving thread, `connect` is
+        # a create_connection compatible factory so a fake server can be
+        # swapped in
+        self.port_file = os.path.join(project_dir, '.ensime_cache/http')
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self.on_connect = on_connect
+        self.connect = connect
+        self.options = {
+            'subprotocols': ['jerky'],
+            'enable_multithread': True
+        }
+        self.ws = None
+        self.url = None
+        self.thread = None
+        self.writer = None
+        self.outbox = Queue.Queue()
+        self.lock = Lock()
+        self.closed = Event()
+
+    @property
+    def is_connected(self):
+        return self.ws is not None
+
+    def read_url(self):
+        port = int(open(self.port_file, 'r').read().strip())
+        return "ws://127.0.0.1:{}/websocket".format(port)
+
+    def start(self):
+        self._open()
+        self.closed.clear()
+        self.thread = Thread(name='recv', target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.writer = Thread(name='send', target=self._write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def send(self, data):
+        # queued for the writer thread so callers never block on the socket
+        if self.ws is None:
+            raise TransportClosed(self.url)
+        self.outbox.put(data)
+
+    def close(self):
+        self.closed.set()
+        self.outbox.put(None)
+        self._drop()
+
+    def watch(self, filename):
+        # ENSIME sends the notes of every file regardless, see MuxTransport
+        pass
+
+    def unwatch(self, filename):
+        pass
+
+    def _write(self):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                return
+            ws = self.ws
+            if ws is None:
+                continue
+            try:
+                with self.lock:
+                    ws.send(data)
+            except Exception:
+                # the receiving thread notices the dead connection
+                pass
+
+    def _open(self):
+        url = self.read_url()
+        ws = self.connect(url, **self.options)
+        self.url = url
+        self.ws = ws
+
+    def _drop(self):
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        while not self.closed.is_set():
+            ws = self.ws
+            try:
+                message = ws.recv()
+            except Exception as e:
+                message = None
+                error = e
+            else:
+                error = None
+            if message:
+                self.on_message(message)
+                continue
+            if self.closed.is_set():
+                return
+            self._drop()
+            self.on_disconnect(error)
+            if not self._reconnect():
+                return
+            self.on_connect()
+
+    def _reconnect(self):
+        # the server may have been restarted on a new port, so the port
+        # file is read again on every attempt
+        delay = INITIAL_BACKOFF
+        while not self.closed.wait(delay):
+            try:
+                self._open()
+                return True
+            except Exception:
+                delay = min(delay * 2, MAX_BACKOFF)
+        return False
+
+
+class MuxTransport(WebsocketTransport):
+    # talks to the shared multiplexer of the project instead of to ENSIME,
+    # only notifications with the given typehints, and only notes of the
+    # files open in this editor, are forwarded to it
+    def __init__(self, project_dir, on_message, on_disconnect, on_connect,
+                 subscriptions, files=()):
+        super(MuxTransport, self).__init__(
+            project_dir, on_message, on_disconnect, on_connect,
+            connect=unix_connection)
+        self.socket_path = socket_path(project_dir)
+        self.subscriptions = sorted(subscriptions)
+        self.files = set(files)
+
+    def read_url(self):
+        return self.socket_path
+
+    def watch(self, filename):
+        self._files('open', filename)
+
+    def unwatch(self, filename):
+        self._files('close', filename)
+
+    def _files(self, change, filename):
+        with self.lock:
+            if (filename in self.files) == (change == 'open'):
+                return
+            if change == 'open':
+                self.files.add(filename)
+            else:
+                self.files.discard(filename)
+        try:
+            self.send(codec.dumps({change: [filename]}))
+        except TransportClosed:
+            # the whole set is sent again once reconnected
+            pass
+
+    def _open(self):
+        super(MuxTransport, self)._open()
+        with self.lock:
+            self.ws.send(codec.dumps({
+                'subscribe': self.subscriptions,
+                'files': sorted(self.files)
+            }))
@@ -0,0 +1,64 @@
+from functools import partial
+from threading import Timer
+
+
+class TypecheckScheduler(object):
+    def __init__(self, delay, schedule, send, supersede):
+        # `schedule` runs a callable on the Neovim main loop, `send` issues
+        # the typecheck for a file and returns its PendingRequest and
+        # `supersede` is told when a newer typecheck replaces older results
+        self.delay = delay
+        self.schedule = schedule
+        self.send = send
+        self.supersede = supersede
+        self.timers = {}
+        self.in_flight = {}
+        self.queued = set()
+
+    def request(self, filename):
+        # debounced, every call restarts the timer for the file
+        timer = self.timers.pop(filename, None)
+        if timer is not None:
+            timer.cancel()
+        timer = Timer(
+            self.delay, self.schedule, [partial(self.now, filename)])
+        timer.daemon = True
+        self.timers[filename] = timer
+        timer.start()
+
+    def now(self, filename):
+        timer = self.timers.pop(filename, None)
+        if timer is not None:
+            timer.cancel()
+        if filename in self.in_flight:
+            # at most one typecheck per file, the queued one is sent as soon
+            # as the current one completes and anything it reports is stale
+            self.queued.add(filename)
+            self.supersede(filename, True)
+            return
+        self._send(filename)
+
+    def cancel(self, matching=None):
+        # every file, or only those `matching` returns true for; the notes
+        # of a file whose queued typecheck is dropped are no longer stale
+        matching = matching or (lambda filename: True)
+        for filename in [f for f in self.timers if matching(f)]:
+            self.timers.pop(filename).cancel()
+        for filename in [f for f in self.queued if matching(f)]:
+            self.queued.discard(filename)
+            self.supersede(filename, False)
+        for filename in [f for f in self.in_flight if matching(f)]:
+            del self.in_flight[filename]
+
+    def _send(self, filename):
+        self.supersede(filename, False)
+        request = self.send(filename)
+        self.in_flight[filename] = request
+        request.add_done_callback(partial(self._done, filename))
+
+    def _done(self, filename, request):
+        if self.in_flight.get(filename) is request:
+            del self.in_flight[filename]
+        if filename in self.queued:
+            self.queued.discard(filename)
+            self._send(filename)
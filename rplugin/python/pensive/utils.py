@@ -1,75 +1,317 @@
+import os
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
+from itertools import chain
+from threading import Lock
+
 severities = {
     'NoteError': 'E',
     'NoteWarning': 'W'
 }
 
 
-class QuickfixEntry(object):
-    def __init__(self):
-        self.filename = None
-        self.line_number = None
-        self.column = None
-        self.description = None
-        self.severity = None
+class QuickfixEntry(namedtuple(
+        'QuickfixEntry', 'filename line_number column severity text')):
+    # a plain tuple, so it hashes and compares by value and sorts by file,
+    # position, severity and message
+    __slots__ = ()
 
     def __repr__(self):
         return '[QuickfixEntry: %s]' % str(self.to_dict())
 
-    def __eq__(self, other):
-        if not isinstance(other, QuickfixEntry):
-            return False
-
-        return (
-            self.filename == other.filename and
-            self.line_number == other.line_number and
-            self.column == other.column and
-            self.description == other.description and
-            self.severity == other.severity
-        )
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
-
-    def __hash__(self):
-        return (
-            self.filename.__hash__() +
-            self.line_number.__hash__() +
-            self.column.__hash__() +
-            self.description.__hash__() +
-            self.severity.__hash__()
-        )
-
     def to_dict(self):
+        # unpacked at once, the named fields are properties and slow to
+        # read one by one under Python 2
+        filename, line_number, column, severity, text = self
         result = {}
-        if self.filename:
-            result['filename'] = self.filename
-        if self.line_number is not None:
-            result['lnum'] = self.line_number
-        if self.column is not None:
-            result['col'] = self.column
-        if self.text is not None:
-            result['text'] = self.text
-        if self.severity is not None:
-            result['type'] = self.severity
-
+        if filename:
+            result['filename'] = filename
+        if line_number is not None:
+            result['lnum'] = line_number
+        if column is not None:
+            result['col'] = column
+        if text is not None:
+            result['text'] = text
+        if severity is not None:
+            result['type'] = severity
         return result
 
     @classmethod
     def fromScalaNote(cls, payload):
-        entry = QuickfixEntry()
-        entry.filename = str(payload['file'])
-        entry.line_number = payload['line']
-        entry.column = payload['col']
-        entry.text = str(payload['msg'])
-        entry.severity = severities.get(payload['severity']['typehint'], '')
-        return entry
+        return cls(
+            payload['file'],
+            payload['line'],
+            payload['col'],
+            severities.get(payload['severity']['typehint'], ''),
+            payload['msg'])
+
+
+class ScalaNotes(object):
+    # entries per file in sorted lists, so finding one is a binary search
+    # and listing them all needs no sort; inserting still shifts the rest
+    # of the file's list, which stays cheap as scalac reports at most
+    # -Xmaxerrs plus -Xmaxwarns (100 each by default) notes per run
+    def __init__(self):
+        self.files = {}
+        # files with a newer typecheck pending, their notes are superseded
+        self.suppressed = set()
+
+    def __len__(self):
+        return sum(len(notes) for notes in self.files.values())
+
+    def add(self, entries):
+        # returns only the entries that were not already known, ordered the
+        # same way the full quickfix list would be
+        added = []
+        for entry in entries:
+            if entry.filename in self.suppressed:
+                continue
+            notes = self.files.get(entry.filename)
+            if notes is None:
+                notes = self.files[entry.filename] = []
+            index = bisect_left(notes, entry)
+            if index < len(notes) and notes[index] == entry:
+                continue
+            notes.insert(index, entry)
+            added.append(entry)
+        added.sort()
+        return added
+
+    def remove(self, filename):
+        return bool(self.files.pop(filename, None))
+
+    def suppress(self, filename):
+        self.suppressed.add(filename)
+
+    def unsuppress(self, filename):
+        self.suppressed.discard(filename)
+
+    def entries(self):
+        files = self.files
+        return chain.from_iterable(files[f] for f in sorted(files))
+
+    def clear(self):
+        self.files.clear()
+
+
+class ProjectNotes(object):
+    # a ScalaNotes per project root, the quickfix list shows all of them
+    def __init__(self):
+        self.projects = {}
+
+    def __getitem__(self, root):
+        notes = self.projects.get(root)
+        if notes is None:
+            notes = self.projects[root] = ScalaNotes()
+        return notes
+
+    def __len__(self):
+        return sum(len(notes) for notes in self.projects.values())
+
+    def entries(self):
+        for root in sorted(self.projects):
+            for entry in self.projects[root].entries():
+                yield entry
+
+
+class PriorityInbox(object):
+    # replies to requests are handed out before any notification, except
+    # those to requests registered with keep_order; queued notifications
+    # with a `coalesced` typehint are not queued again and one with a
+    # `supersedes` typehint drops the queued ones it makes moot, both only
+    # among the notifications of the same project
+    def __init__(self, coalesced=(), supersedes=None):
+        self.replies = deque()
+        self.notifications = deque()
+        self.coalesced = set(coalesced)
+        self.supersedes = supersedes or {}
+        self.waiting = set()
+        self.ordered = set()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.replies) + len(self.notifications)
+
+    def keep_order(self, call_id):
+        # the reply to `call_id` is handed out after the notifications
+        # queued before it arrived
+        with self.lock:
+            self.ordered.add(call_id)
+
+    def forget(self, call_id):
+        with self.lock:
+            self.ordered.discard(call_id)
+
+    def put(self, message):
+        with self.lock:
+            call_id = message.get('callId')
+            if call_id in self.ordered:
+                self.ordered.discard(call_id)
+                self.notifications.append(message)
+                return
+            if call_id is not None:
+                self.replies.append(message)
+                return
+            project = message.get('project')
+            typehint = message.get('payload', {}).get('typehint')
+            if typehint in self.coalesced:
+                if (project, typehint) in self.waiting:
+                    return
+                self.waiting.add((project, typehint))
+            superseded = self.supersedes.get(typehint)
+            if superseded:
+                self.notifications = deque(
+                    m for m in self.notifications
+                    if m.get('project') != project or
+                    m['payload'].get('typehint') not in superseded
+                )
+                self.waiting.difference_update(
+                    (project, t) for t in superseded)
+            self.notifications.append(message)
+
+    def get(self):
+        # returns None when there is nothing queued
+        with self.lock:
+            if self.replies:
+                return self.replies.popleft()
+            if self.notifications:
+                message = self.notifications.popleft()
+                self.waiting.discard((
+                    message.get('project'),
+                    message['payload'].get('typehint')))
+                return message
+            return None
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ResponseCache(object):
+    # keys are (filename, start, end, changedtick, typehint) tuples
+    def __init__(self, maxsize=256):
+        self.responses = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.responses)
+
+    def __contains__(self, key):
+        return key in self.responses
+
+    def get(self, key):
+        response = self.responses.get(key)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def put(self, key, response):
+        self.responses.put(key, response)
+
+    def invalidate(self, filename):
+        for key in [k for k in self.responses.entries if k[0] == filename]:
+            self.responses.discard(key)
+
+    def clear(self):
+        self.responses.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self.responses),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+def decode(text):
+    if isinstance(text, bytes):
+        return text.decode('utf-8', 'replace')
+    return text
+
+
+class LineIndex(object):
+    # ENSIME offsets count characters, Vim columns count bytes
+    def __init__(self, lines):
+        self.lines = lines
+        self.starts = []
+        offset = 0
+        for line in lines:
+            self.starts.append(offset)
+            offset += len(decode(line))
+        if not self.starts:
+            self.starts.append(0)
+
+    @classmethod
+    def fromFile(cls, path):
+        with open(path, 'r') as fh:
+            return cls(fh.readlines())
 
     @classmethod
-    def fromVim(cls, payload):
-        entry = QuickfixEntry()
-        entry.filename = str(payload['file'])
-        entry.line_number = payload['lnum']
-        entry.column = payload['col']
-        entry.text = str(payload['text'])
-        entry.severity = payload['type']
-        return entry
+    def fromBuffer(cls, lines):
+        return cls([line + '\n' for line in lines])
+
+    def position(self, offset):
+        # returns the 1-based line and byte column for a 0-based offset
+        index = max(bisect_right(self.starts, offset) - 1, 0)
+        chars = offset - self.starts[index]
+        if index < len(self.lines):
+            prefix = decode(self.lines[index])[:chars]
+            return index + 1, len(prefix.encode('utf-8')) + 1
+        return index + 1, chars + 1
+
+    def line(self, line_number):
+        if 0 < line_number <= len(self.lines):
+            return self.lines[line_number - 1].rstrip('\r\n')
+        return ''
+
+
+class LineIndexCache(object):
+    def __init__(self, maxsize=64):
+        self.indexes = LRUCache(maxsize)
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (st.st_mtime, st.st_size)
+        cached = self.indexes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        index = LineIndex.fromFile(path)
+        self.indexes.put(path, (key, index))
+        return index
+
+    def clear(self):
+        self.indexes.clear()
@@ -0,0 +1,252 @@
+"""Every command handler returns right away while the I/O it starts is slow.
+
+    python -m unittest discover -s tests
+
+Connecting, closing connections, stopping servers, starting them and
+opening the symbol index are all made to take SLOW seconds; each command
+registered by EnsimeClient must still return within LIMIT.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'rplugin', 'python'))
+sys.path.insert(0, os.path.join(HERE, '..', 'rplugin', 'python', 'pensive'))
+
+
+def stand_in(name, **members):
+    # only used when the real package is not installed
+    try:
+        __import__(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(members)
+        sys.modules[name] = module
+
+
+def rpc(kind):
+    # records the handler the way the neovim package's decorators do
+    def decorator(name=None, **opts):
+        def register(fn):
+            fn._nvim_rpc_spec = {'type': kind, 'name': name, 'opts': opts}
+            return fn
+        return register
+    return decorator
+
+
+def unavailable(*args, **kwargs):
+    raise IOError('no network in tests')
+
+
+stand_in('neovim', plugin=lambda cls: cls, command=rpc('command'),
+         autocmd=rpc('autocmd'), function=rpc('function'))
+stand_in('websocket', create_connection=unavailable)
+
+import launcher  # noqa: E402
+import pensive  # noqa: E402
+from projects import IDLE_TIMEOUT  # noqa: E402
+
+# seconds every blocking operation takes here
+SLOW = 0.5
+# seconds a command handler may take
+LIMIT = 0.05
+
+
+class SlowTransport(object):
+    def __init__(self, *args, **kwargs):
+        self.url = 'ws://127.0.0.1:0/websocket'
+        self.sent = []
+
+    def start(self):
+        time.sleep(SLOW)
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        time.sleep(SLOW)
+
+    def watch(self, filename):
+        pass
+
+    def unwatch(self, filename):
+        pass
+
+
+class SlowServer(object):
+    returncode = None
+
+    def poll(self):
+        return None
+
+    def terminate(self):
+        time.sleep(SLOW)
+
+    def kill(self):
+        pass
+
+    def wait(self):
+        return 0
+
+
+class SlowSymbolIndex(object):
+    @classmethod
+    def forProject(cls, root):
+        time.sleep(SLOW)
+        return cls()
+
+    def add(self, entries):
+        return 0
+
+    def add_use(self, *args):
+        return False
+
+    def resolve(self, path, offset):
+        return None
+
+    def find(self, local_name, filename=None):
+        return None
+
+
+def slow_launch(config_path):
+    time.sleep(SLOW)
+    return SlowServer()
+
+
+class Buffer(object):
+    def __init__(self, name, number):
+        self.name = name
+        self.number = number
+        self.lines = []
+
+    def __setitem__(self, index, lines):
+        self.lines = lines
+
+
+class Session(object):
+    def __init__(self):
+        self.calls = []
+
+    def threadsafe_call(self, fn, *args):
+        # results of background work are not needed here
+        self.calls.append((fn, args))
+
+
+class Api(object):
+    def create_namespace(self, name):
+        return 1
+
+    def call_atomic(self, calls):
+        return [[], None]
+
+
+class Vim(object):
+    # answers the expressions the commands evaluate for a Scala buffer
+    def __init__(self, filename):
+        self.filename = filename
+        self.vars = {}
+        self.session = Session()
+        self.api = Api()
+        self.current = types.ModuleType('current')
+        self.current.buffer = Buffer(filename, 1)
+        self.commands = []
+
+    def eval(self, expr):
+        if expr == "expand('%:p')":
+            return self.filename
+        if expr.startswith("[expand('%:p'), bufnr('%'), b:changedtick"):
+            starts, _, ends = expr.partition("map([")[2].partition("map([")
+            result = [self.filename, 1, 7, 0,
+                      [10] * starts.count('getpos'),
+                      [12] * ends.count('getpos')]
+            if "expand('<cword>')" in expr:
+                result.extend([2, 'foo'])
+            return result
+        if expr.startswith("[get(g:, 'pensive_log_level'"):
+            return ['off', '']
+        if expr.startswith('map(filter(getbufinfo('):
+            return [self.filename]
+        if expr.startswith("get(g:, 'pensive_implicits'"):
+            return []
+        raise AssertionError('unexpected expression: %s' % expr)
+
+    def command(self, command):
+        self.commands.append(command)
+
+    def call(self, name, *args):
+        return None
+
+
+def commands(cls):
+    for name in sorted(dir(cls)):
+        spec = getattr(getattr(cls, name), '_nvim_rpc_spec', None)
+        if spec is not None and spec['type'] == 'command':
+            yield spec['name'], name, spec['opts']
+
+
+def arguments(opts):
+    nargs = opts.get('nargs')
+    if nargs in ('+', '1'):
+        return (['Foo'],)
+    if nargs in ('?', '*'):
+        return ([],)
+    return ()
+
+
+class CommandsDoNotBlock(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        open(os.path.join(self.root, '.ensime'), 'w').close()
+        os.mkdir(os.path.join(self.root, 'src'))
+        self.filename = os.path.join(self.root, 'src', 'A.scala')
+        open(self.filename, 'w').close()
+
+        self.patched = [
+            (pensive, 'WebsocketTransport', SlowTransport),
+            (pensive, 'MuxTransport', SlowTransport),
+            (pensive, 'SymbolIndex', SlowSymbolIndex),
+            (launcher, 'launch', slow_launch)
+        ]
+        self.originals = [
+            (m, name, getattr(m, name)) for m, name, _ in self.patched]
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+
+        self.vim = Vim(self.filename)
+        self.client = pensive.EnsimeClient(self.vim)
+
+    def tearDown(self):
+        for module, name, value in self.originals:
+            setattr(module, name, value)
+        shutil.rmtree(self.root)
+
+    def assertCommandsReturn(self):
+        found = list(commands(pensive.EnsimeClient))
+        self.assertTrue(found)
+        for command, method, opts in found:
+            start = time.time()
+            getattr(self.client, method)(*arguments(opts))
+            elapsed = time.time() - start
+            self.assertLess(
+                elapsed, LIMIT, '%s took %.3fs' % (command, elapsed))
+
+    def test_while_connecting(self):
+        # every request opens the connection first
+        self.assertCommandsReturn()
+
+    def test_while_connected(self):
+        # closing the idle connection and stopping the server are slow too
+        project = self.client.project(self.filename)
+        project.transport = SlowTransport()
+        project.server = SlowServer()
+        project.last_used = time.time() - IDLE_TIMEOUT - 1
+        self.assertCommandsReturn()
+
+
+if __name__ == '__main__':
+    unittest.main()